@@ -0,0 +1,48 @@
+-- Core tables. Written with "if not exists" so it can be applied to the
+-- existing database as a baseline as well as to a fresh one.
+--
+-- The unique indexes fail to build if the data already has duplicates;
+-- merge duplicate friends (User Options > Merge Friends) first.
+
+create table if not exists users (
+    u_id bigint generated by default as identity primary key,
+    username text not null,
+    password_hash text not null,
+    salt text not null,
+    role text not null default 'user' check (role in ('admin', 'user'))
+);
+
+create unique index if not exists users_username_key on users (username);
+
+create table if not exists friends (
+    f_id bigint generated by default as identity primary key,
+    user_id bigint not null references users (u_id) on delete cascade,
+    name text not null
+);
+
+create unique index if not exists friends_user_id_name_key on friends (user_id, name);
+
+create table if not exists media_types (
+    m_id bigint generated by default as identity primary key,
+    type_name text not null
+);
+
+create unique index if not exists media_types_type_name_key on media_types (type_name);
+
+insert into media_types (type_name)
+select type_name from (values ('Movie'), ('TV Show'), ('Book'), ('Podcast'), ('Music')) as t (type_name)
+where not exists (select 1 from media_types);
+
+create table if not exists media_items (
+    item_id bigint generated by default as identity primary key,
+    user_id bigint not null references users (u_id) on delete cascade,
+    title text not null,
+    media_type_id bigint references media_types (m_id),
+    creator text,
+    link text,
+    notes text,
+    suggested_by bigint references friends (f_id) on delete cascade,
+    date timestamptz not null default now(),
+    priority text check (priority in ('High', 'Medium', 'Low')),
+    rating smallint check (rating between 1 and 10)
+);
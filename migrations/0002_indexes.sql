@@ -0,0 +1,21 @@
+-- Indexes behind the queries the app issues (see HOT_QUERIES in
+-- nextbest_migrate.py, which checks their plans). Every media_items read is
+-- scoped to one user, so user_id leads each index.
+
+-- Library loads and item edits (user_id = ? order by item_id)
+create index if not exists media_items_user_id_item_id_idx on media_items (user_id, item_id);
+
+-- Filters by media type, and the per-type stats
+create index if not exists media_items_user_id_media_type_id_idx on media_items (user_id, media_type_id);
+
+-- Friend cascade deletes, friend merges and the per-friend leaderboard RPCs
+create index if not exists media_items_user_id_suggested_by_idx on media_items (user_id, suggested_by);
+
+-- Unrated / rated splits (What Next?, Best Ratings)
+create index if not exists media_items_user_id_rating_idx on media_items (user_id, rating);
+
+-- Incremental trend refreshes (user_id = ? and date >= ? and date < ?)
+create index if not exists media_items_user_id_date_idx on media_items (user_id, date);
+
+-- Deleting a friend checks media_items.suggested_by for the foreign key
+create index if not exists media_items_suggested_by_idx on media_items (suggested_by);
@@ -0,0 +1,58 @@
+-- The three Leaderboard RPCs (page_Leaderboard, nextbest_data.leaderboard_stats).
+-- Column names are what the app reads from the result rows.
+
+-- Friends by the average rating of their rated suggestions
+drop function if exists top_friends_avg_rating(bigint);
+create function top_friends_avg_rating(user_id_param bigint)
+returns table (friend_name text, avg_rating numeric)
+language sql
+stable
+as $$
+    select f.name, round(avg(m.rating), 2)
+    from media_items m
+    join friends f on f.f_id = m.suggested_by
+    where m.user_id = user_id_param
+      and f.user_id = user_id_param
+      and m.rating is not null
+    group by f.f_id, f.name
+    order by 2 desc, f.name;
+$$;
+
+-- Friends by how many suggestions they've made
+drop function if exists top_friends_total_suggestions(bigint);
+create function top_friends_total_suggestions(user_id_param bigint)
+returns table (friend_name text, total_suggestions bigint)
+language sql
+stable
+as $$
+    select f.name, count(*)
+    from media_items m
+    join friends f on f.f_id = m.suggested_by
+    where m.user_id = user_id_param
+      and f.user_id = user_id_param
+    group by f.f_id, f.name
+    order by 2 desc, f.name;
+$$;
+
+-- The friend whose newest unrated suggestion has waited the longest,
+-- with that suggestion
+drop function if exists top_neglected_friend(bigint);
+create function top_neglected_friend(user_id_param bigint)
+returns table (friend_name text, latest_suggestion_date timestamptz, title text, media_type_id bigint)
+language sql
+stable
+as $$
+    select friend_name, latest_suggestion_date, title, media_type_id
+    from (
+        select distinct on (m.suggested_by)
+            f.name as friend_name, m.date as latest_suggestion_date, m.title, m.media_type_id
+        from media_items m
+        join friends f on f.f_id = m.suggested_by
+        where m.user_id = user_id_param
+          and f.user_id = user_id_param
+          and m.rating is null
+        order by m.suggested_by, m.date desc
+    ) latest
+    order by latest_suggestion_date
+    limit 1;
+$$;
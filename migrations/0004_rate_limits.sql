@@ -0,0 +1,37 @@
+-- Shared token buckets for nextbest_limits.SupabaseRateLimiter.
+-- Every replica takes tokens from the same row, and the upsert's row lock
+-- makes refill-and-take atomic.
+
+create table if not exists rate_limit_buckets (
+    bucket_key text primary key,
+    tokens double precision not null,
+    updated_at timestamptz not null default now()
+);
+
+create or replace function take_rate_limit_token(
+    bucket_key_param text,
+    capacity double precision,
+    refill_per_sec double precision,
+    cost double precision default 1
+)
+returns boolean
+language plpgsql
+as $$
+declare
+    current_tokens double precision;
+begin
+    insert into rate_limit_buckets as b (bucket_key, tokens, updated_at)
+    values (bucket_key_param, capacity, now())
+    on conflict (bucket_key) do update
+        set tokens = least(capacity, b.tokens + extract(epoch from now() - b.updated_at) * refill_per_sec),
+            updated_at = now()
+    returning tokens into current_tokens;
+
+    if current_tokens < cost then
+        return false;
+    end if;
+
+    update rate_limit_buckets set tokens = tokens - cost where bucket_key = bucket_key_param;
+    return true;
+end;
+$$;
@@ -0,0 +1,20 @@
+-- Free-form item tags (genre, mood, platform...).
+-- item_tags' primary key (tag_id, item_id) is the server-side inverted index:
+-- each tag's item ids are stored together and in order.
+
+create table if not exists tags (
+    tag_id bigint generated always as identity primary key,
+    user_id bigint not null references users (u_id) on delete cascade,
+    name text not null,
+    unique (user_id, name)
+);
+
+create table if not exists item_tags (
+    tag_id bigint not null references tags (tag_id) on delete cascade,
+    item_id bigint not null references media_items (item_id) on delete cascade,
+    user_id bigint not null references users (u_id) on delete cascade,
+    primary key (tag_id, item_id)
+);
+
+create index if not exists item_tags_item_id_idx on item_tags (item_id);
+create index if not exists item_tags_user_id_idx on item_tags (user_id, tag_id, item_id);
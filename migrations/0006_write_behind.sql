@@ -0,0 +1,6 @@
+-- Idempotency key for items written by the write-behind journal
+-- (nextbest_journal.py). Replaying an add upserts on op_id instead of
+-- inserting a duplicate.
+
+alter table media_items add column if not exists op_id uuid;
+create unique index if not exists media_items_op_id_key on media_items (op_id);
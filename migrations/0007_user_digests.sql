@@ -0,0 +1,14 @@
+-- Per-user digest of the unrated backlog, rebuilt nightly by the
+-- nightly_digest job (nextbest_digest.py). Pages read one row by user_id.
+
+create table if not exists user_digests (
+    user_id bigint primary key references users (u_id) on delete cascade,
+    computed_at timestamptz not null default now(),
+    backlog_total integer not null default 0,
+    neglected_friends jsonb not null default '[]',
+    stale_high_priority jsonb not null default '[]',
+    backlog_by_type jsonb not null default '{}'
+);
+
+-- The nightly pass reads only unrated items, in item_id order
+create index if not exists media_items_unrated_idx on media_items (item_id) where rating is null;
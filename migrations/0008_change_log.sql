@@ -0,0 +1,170 @@
+-- Append-only change log for media_items (nextbest_history.py).
+-- Triggers record every insert, update and delete, whichever path made it
+-- (app, write-behind journal, CLI imports, merges). Updates keep only the
+-- fields that changed, old and new. Inserts and deletes keep the whole row.
+-- Statement-level triggers with transition tables log a bulk write with a
+-- single insert.
+
+create table if not exists media_item_changes (
+    change_id bigint generated always as identity primary key,
+    user_id bigint not null references users (u_id) on delete cascade,
+    item_id bigint not null,
+    ts timestamptz not null default now(),
+    op text not null check (op in ('insert', 'update', 'delete')),
+    old_values jsonb,
+    new_values jsonb,
+    undone boolean not null default false
+);
+
+-- Per-item history, and each user's most recent changes for undo
+create index if not exists media_item_changes_history_idx on media_item_changes (user_id, item_id, ts);
+create index if not exists media_item_changes_user_idx on media_item_changes (user_id, change_id);
+
+-- Compacted history: an item's state as of its last folded change
+create table if not exists media_item_snapshots (
+    item_id bigint primary key,
+    user_id bigint not null references users (u_id) on delete cascade,
+    ts timestamptz not null,
+    last_change_id bigint not null,
+    state jsonb not null,
+    deleted boolean not null default false
+);
+
+create index if not exists media_item_snapshots_user_idx on media_item_snapshots (user_id, item_id);
+
+create or replace function log_media_item_changes()
+returns trigger
+language plpgsql
+as $$
+begin
+    -- Reverting through undo_item_changes isn't itself a change to log
+    if current_setting('nextbest.undoing', true) = 'on' then
+        return null;
+    end if;
+
+    if tg_op = 'INSERT' then
+        insert into media_item_changes (user_id, item_id, op, new_values)
+        select n.user_id, n.item_id, 'insert', to_jsonb(n) from new_rows n;
+    elsif tg_op = 'DELETE' then
+        insert into media_item_changes (user_id, item_id, op, old_values)
+        select o.user_id, o.item_id, 'delete', to_jsonb(o) from old_rows o;
+    else
+        insert into media_item_changes (user_id, item_id, op, old_values, new_values)
+        select n.user_id, n.item_id, 'update', d.old_values, d.new_values
+        from new_rows n
+        join old_rows o on o.item_id = n.item_id
+        cross join lateral (
+            select jsonb_object_agg(ov.key, ov.value) as old_values,
+                   jsonb_object_agg(ov.key, nv.value) as new_values
+            from jsonb_each(to_jsonb(o)) ov
+            join jsonb_each(to_jsonb(n)) nv on nv.key = ov.key
+            where ov.value is distinct from nv.value
+        ) d
+        where d.old_values is not null;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists media_items_log_insert on media_items;
+create trigger media_items_log_insert after insert on media_items
+    referencing new table as new_rows
+    for each statement execute function log_media_item_changes();
+
+drop trigger if exists media_items_log_update on media_items;
+create trigger media_items_log_update after update on media_items
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function log_media_item_changes();
+
+drop trigger if exists media_items_log_delete on media_items;
+create trigger media_items_log_delete after delete on media_items
+    referencing old table as old_rows
+    for each statement execute function log_media_item_changes();
+
+-- Revert a user's last n changes that haven't been undone, newest first.
+-- Returns the ids of the items touched.
+create or replace function undo_item_changes(user_id_param bigint, n integer default 1)
+returns setof bigint
+language plpgsql
+as $$
+declare
+    c media_item_changes;
+begin
+    perform set_config('nextbest.undoing', 'on', true);
+    for c in
+        select * from media_item_changes
+        where user_id = user_id_param and not undone
+        order by change_id desc
+        limit n
+        for update
+    loop
+        if c.op = 'insert' then
+            delete from media_items where item_id = c.item_id and user_id = user_id_param;
+        elsif c.op = 'delete' then
+            insert into media_items
+            select * from jsonb_populate_record(null::media_items, c.old_values)
+            on conflict (item_id) do nothing;
+        else
+            update media_items m
+            set (title, media_type_id, creator, link, notes, suggested_by, date, priority, rating) = (
+                select r.title, r.media_type_id, r.creator, r.link, r.notes, r.suggested_by, r.date, r.priority, r.rating
+                from jsonb_populate_record(m, c.old_values) r
+            )
+            where m.item_id = c.item_id and m.user_id = user_id_param;
+        end if;
+        update media_item_changes set undone = true where change_id = c.change_id;
+        return next c.item_id;
+    end loop;
+    perform set_config('nextbest.undoing', 'off', true);
+end;
+$$;
+
+-- jsonb || over an ordered set of rows: later keys win
+create or replace aggregate jsonb_merge_agg(jsonb) (
+    sfunc = jsonb_concat,
+    stype = jsonb,
+    initcond = '{}'
+);
+
+-- Fold changes older than older_than into per-item snapshots, keeping
+-- each item's keep_recent newest changes as events. Undone changes are
+-- dropped. Returns the number of change rows removed.
+create or replace function compact_item_changes(older_than interval default '30 days', keep_recent integer default 20)
+returns bigint
+language plpgsql
+as $$
+declare
+    removed bigint;
+begin
+    create temporary table folded on commit drop as
+    select change_id, user_id, item_id, ts, op, new_values, undone
+    from (
+        select c.*, row_number() over (partition by c.item_id order by c.change_id desc) as recent
+        from media_item_changes c
+        where c.ts < now() - older_than
+    ) ranked
+    where recent > keep_recent or undone;
+
+    insert into media_item_snapshots as s (item_id, user_id, ts, last_change_id, state, deleted)
+    select f.item_id,
+           min(f.user_id),
+           max(f.ts),
+           max(f.change_id),
+           coalesce(
+               (select s2.state from media_item_snapshots s2 where s2.item_id = f.item_id), '{}'::jsonb
+           ) || coalesce(jsonb_merge_agg(coalesce(f.new_values, '{}'::jsonb) order by f.change_id), '{}'::jsonb),
+           (array_agg(f.op order by f.change_id desc))[1] = 'delete'
+    from folded f
+    where not f.undone
+    group by f.item_id
+    on conflict (item_id) do update
+        set ts = excluded.ts,
+            last_change_id = excluded.last_change_id,
+            state = excluded.state,
+            deleted = excluded.deleted;
+
+    delete from media_item_changes c using folded f where c.change_id = f.change_id;
+    get diagnostics removed = row_count;
+    return removed;
+end;
+$$;
@@ -0,0 +1,9 @@
+-- Case-insensitive username prefix search for the admin page (search_users).
+-- ilike can't use users_username_key, so each search walked every user.
+-- PostgREST can only filter on columns, so the lowercased name is a
+-- generated column, indexed with text_pattern_ops so like 'prefix%' is an
+-- index range scan whatever the database collation.
+
+alter table users add column if not exists username_lower text generated always as (lower(username)) stored;
+
+create index if not exists users_username_lower_idx on users (username_lower text_pattern_ops);
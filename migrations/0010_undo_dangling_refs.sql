@@ -0,0 +1,60 @@
+-- undo_item_changes restored suggested_by and media_type_id as logged, so
+-- undoing a change to an item whose friend has since been deleted or merged
+-- away raised a foreign key violation, and every later undo for that user
+-- failed on the same change until it was compacted. A reference that no
+-- longer exists (or, for a friend, belongs to another user) is now restored
+-- as null instead.
+
+create or replace function undo_item_changes(user_id_param bigint, n integer default 1)
+returns setof bigint
+language plpgsql
+as $$
+declare
+    c media_item_changes;
+    m media_items;
+    r media_items;
+begin
+    perform set_config('nextbest.undoing', 'on', true);
+    for c in
+        select * from media_item_changes
+        where user_id = user_id_param and not undone
+        order by change_id desc
+        limit n
+        for update
+    loop
+        if c.op = 'insert' then
+            delete from media_items where item_id = c.item_id and user_id = user_id_param;
+        else
+            if c.op = 'delete' then
+                r := jsonb_populate_record(null::media_items, c.old_values);
+            else
+                select * into m from media_items where item_id = c.item_id and user_id = user_id_param;
+                r := jsonb_populate_record(m, c.old_values);
+            end if;
+
+            if r.suggested_by is not null and not exists (
+                select 1 from friends where f_id = r.suggested_by and user_id = user_id_param
+            ) then
+                r.suggested_by := null;
+            end if;
+            if r.media_type_id is not null and not exists (
+                select 1 from media_types where m_id = r.media_type_id
+            ) then
+                r.media_type_id := null;
+            end if;
+
+            if c.op = 'delete' then
+                insert into media_items select r.* on conflict (item_id) do nothing;
+            elsif m.item_id is not null then
+                update media_items
+                set (title, media_type_id, creator, link, notes, suggested_by, date, priority, rating) =
+                    (r.title, r.media_type_id, r.creator, r.link, r.notes, r.suggested_by, r.date, r.priority, r.rating)
+                where item_id = c.item_id and user_id = user_id_param;
+            end if;
+        end if;
+        update media_item_changes set undone = true where change_id = c.change_id;
+        return next c.item_id;
+    end loop;
+    perform set_config('nextbest.undoing', 'off', true);
+end;
+$$;
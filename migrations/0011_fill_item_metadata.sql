@@ -0,0 +1,19 @@
+-- Batched write-back for link enrichment (nextbest_enrich.enrich_user).
+-- Each element of updates is {"item_id", "title", "creator"}; a field is
+-- only written while it is still empty, so anything the user typed while
+-- the fetches ran is kept. Returns the ids of the items changed.
+
+create or replace function fill_item_metadata(user_id_param bigint, updates jsonb)
+returns setof bigint
+language sql
+as $$
+    update media_items m
+    set title = case when m.title = '' and u.title is not null then u.title else m.title end,
+        creator = case when coalesce(m.creator, '') = '' and u.creator is not null then u.creator else m.creator end
+    from jsonb_to_recordset(updates) as u (item_id bigint, title text, creator text)
+    where m.item_id = u.item_id
+      and m.user_id = user_id_param
+      and ((m.title = '' and u.title is not null)
+           or (coalesce(m.creator, '') = '' and u.creator is not null))
+    returning m.item_id;
+$$;
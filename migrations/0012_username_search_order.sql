@@ -0,0 +1,10 @@
+-- search_users orders by username_lower. With the database collation the
+-- text_pattern_ops index from 0009 only serves the like 'prefix%' range, so
+-- the planner walked users_username_key for the order by instead. In the
+-- "C" collation a plain btree serves both the range and the sort, so a page
+-- reads only its rows.
+
+alter table users alter column username_lower type text collate "C";
+
+drop index if exists users_username_lower_idx;
+create index if not exists users_username_lower_c_idx on users (username_lower);
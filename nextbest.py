@@ -0,0 +1,370 @@
+"""
+Headless command line interface for Next Best.
+
+Runs batch jobs (imports, exports, stats, user management) against the same
+data layer as the Streamlit app, without starting the Streamlit runtime.
+
+    python -m nextbest users list
+    python -m nextbest users create alice
+    python -m nextbest users delete alice
+    python -m nextbest items export alice --format jsonl > alice.jsonl
+    python -m nextbest items export alice --format parquet -o alice.parquet
+    python -m nextbest items import alice suggestions.csv
+    python -m nextbest stats alice
+    python -m nextbest enrich alice
+    python -m nextbest dump media_items --format csv > media_items.csv
+    python -m nextbest db migrate
+
+Output is streamed one row at a time as CSV or JSON lines.
+"""
+
+import argparse
+import csv
+import getpass
+import json
+import sys
+
+import nextbest_data as data
+
+# --------------------------
+# Output
+# --------------------------
+
+def write_rows(rows, fmt: str, columns: list[str] | None = None, out=sys.stdout) -> int:
+    """Stream rows to out as csv or jsonl. Returns the number of rows written."""
+    count = 0
+    writer = None
+    for row in rows:
+        if fmt == "jsonl":
+            out.write(json.dumps(row, default=str) + "\n")
+        else:
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=columns or list(row.keys()), extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow(row)
+        count += 1
+    return count
+
+def read_rows(path: str):
+    """Yield dict rows from a .csv or .jsonl file ('-' reads csv from stdin)."""
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            yield from csv.DictReader(f)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def resolve_user(username: str):
+    user = data.get_user(username)
+    if user is None:
+        sys.exit(f"User '{username}' not found")
+    return user
+
+# --------------------------
+# Commands
+# --------------------------
+
+def cmd_users_list(args):
+    rows = data.iter_table("users", "u_id, username, role", order_by="u_id")
+    write_rows(rows, args.format)
+
+def cmd_users_create(args):
+    # Run by an operator, so the app's per-address sign-up rate limit doesn't apply
+    password = args.password or getpass.getpass(f"Password for {args.username}: ")
+    if data.get_user(args.username):
+        sys.exit(f"User '{args.username}' already exists")
+    user = data.create_user(args.username, password)
+    if not user:
+        sys.exit("Failed to create user")
+    print(f"Created user '{user[1]}' (id {user[0]}, role {user[2]})", file=sys.stderr)
+
+def cmd_users_delete(args):
+    u_id, username, _ = resolve_user(args.username)
+
+    def progress(table, deleted, total):
+        print(f"  {table}: {deleted}/{total}", file=sys.stderr)
+
+    if not data.delete_user(u_id, progress=progress):
+        sys.exit(f"Failed to delete user '{username}' (rerun to resume)")
+    print(f"Deleted user '{username}' and all their friends/media items", file=sys.stderr)
+
+def cmd_users_passwd(args):
+    resolve_user(args.username)
+    password = args.password or getpass.getpass(f"New password for {args.username}: ")
+    if not data.change_password(args.username, password):
+        sys.exit("Failed to update password")
+    print(f"Password for '{args.username}' has been updated", file=sys.stderr)
+
+def cmd_items_export(args):
+    import nextbest_export
+
+    if args.format not in nextbest_export.FORMATS:
+        sys.exit("Parquet export needs pyarrow: pip install pyarrow")
+    u_id, _, _ = resolve_user(args.username)
+    if args.format == "parquet" and args.output == "-" and sys.stdout.isatty():
+        sys.exit("Parquet is binary; pass --output or redirect stdout to a file")
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        count = nextbest_export.write_export(nextbest_export.iter_export_rows(u_id), args.format, out)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {count} items", file=sys.stderr)
+
+def cmd_items_import(args):
+    """
+    Import items from csv/jsonl. Rows need title, media_type and friend
+    (by name); creator, link, notes, priority, rating and date are optional.
+    Friends that don't exist yet are created in one batch. Rows with the
+    same title and type as an existing item (or an earlier row) are merged
+    into it rather than inserted, unless --allow-duplicates is given.
+    Nothing is written if the new items or friends would go over the user's
+    quotas (see nextbest_limits).
+    """
+    import nextbest_dedupe
+    from nextbest_limits import QUOTAS, within_quota
+
+    u_id, _, _ = resolve_user(args.username)
+    type_map = {m["type_name"].lower(): m["m_id"] for m in data.list_mediaTypes()}
+    friend_map = {f["name"]: f["f_id"] for f in data.list_friends(u_id)}
+
+    rows = list(read_rows(args.path))
+    skipped = 0
+
+    # Validate every row before writing anything, so skipped rows leave no friends behind
+    valid = []
+    for line, r in enumerate(rows, start=1):
+        title = (r.get("title") or "").strip()
+        m_id = type_map.get((r.get("media_type") or "").strip().lower())
+        friend = (r.get("friend") or "").strip()
+        rating = r.get("rating")
+        error = None
+        if not title:
+            error = "missing title"
+        elif m_id is None:
+            error = f"unknown media type '{r.get('media_type') or ''}'"
+        elif not friend:
+            error = "missing friend"
+        elif rating not in (None, ""):
+            try:
+                rating = int(rating)
+            except (TypeError, ValueError):
+                error = f"rating '{rating}' is not a whole number"
+            else:
+                if not 1 <= rating <= 10:
+                    error = f"rating {rating} is not between 1 and 10"
+        else:
+            rating = None
+        if error:
+            print(f"  row {line}: skipped, {error}", file=sys.stderr)
+            skipped += 1
+            continue
+        valid.append((r, title, m_id, friend, rating))
+
+    items = []
+    for r, title, m_id, friend, rating in valid:
+        items.append({
+            "title": title,
+            "media_type_id": m_id,
+            "friend": friend,
+            "creator": r.get("creator") or None,
+            "link": r.get("link") or None,
+            "notes": r.get("notes") or None,
+            "priority": r.get("priority") or None,
+            "rating": rating,
+            "date": r.get("date") or None,
+        })
+
+    duplicates = merged = 0
+    if not args.allow_duplicates:
+        index = nextbest_dedupe.TitleIndex(
+            (r["item_id"], r["title"], r["media_type_id"])
+            for r in data.iter_table("media_items", "item_id, title, media_type_id", order_by="item_id", user_id=u_id)
+        )
+        rows_read = len(items)
+        items, merges, near = nextbest_dedupe.plan_import(items, index)
+        merged = nextbest_dedupe.merge_into_existing(merges, u_id)
+        duplicates = rows_read - len(items)
+        for item, similar in near:
+            titles = ", ".join(f"'{index.titles[i]}'" for i in similar)
+            print(f"  possible duplicate: '{item['title']}' ~ {titles}", file=sys.stderr)
+
+    # Only rows that will be inserted need a friend; merges keep the existing item's
+    new_friends = sorted({item["friend"] for item in items} - set(friend_map))
+    for table, adding in (("media_items", len(items)), ("friends", len(new_friends))):
+        if adding and not within_quota(u_id, table, adding):
+            sys.exit(f"Importing would go over the limit of {QUOTAS[table]:,} {table.replace('_', ' ')} for this user")
+
+    # Create any missing friends in a single insert
+    if new_friends:
+        res = data.supabase.table("friends").insert([{"name": n, "user_id": u_id} for n in new_friends]).execute()
+        friend_map.update({f["name"]: f["f_id"] for f in res.data or []})
+    for item in items:
+        item["suggested_by"] = friend_map[item.pop("friend")]
+
+    inserted = data.add_mediaItems(items, u_id, batch_size=args.batch_size)
+    print(f"Imported {inserted} items, merged {duplicates} duplicates ({merged} existing items updated), "
+          f"skipped {skipped}, added {len(new_friends)} friends", file=sys.stderr)
+
+def cmd_stats(args):
+    u_id, _, _ = resolve_user(args.username)
+    stats = data.leaderboard_stats(u_id)
+
+    def rows():
+        for rpc_name, rpc_rows in stats.items():
+            for row in rpc_rows:
+                yield {"stat": rpc_name, **row}
+
+    write_rows(rows(), "jsonl" if args.format == "jsonl" else "csv",
+               ["stat", "friend_name", "avg_rating", "total_suggestions"])
+
+def cmd_enrich(args):
+    import nextbest_enrich
+
+    u_id, _, _ = resolve_user(args.username)
+    updated = nextbest_enrich.enrich_user(u_id)
+    print(f"Enriched {updated} items from their links", file=sys.stderr)
+
+# table -> primary key
+DUMP_TABLES = {"users": "u_id", "friends": "f_id", "media_types": "m_id", "media_items": "item_id"}
+
+def cmd_dump(args):
+    # Pages are read with offsets, so they need a stable order to not skip or repeat rows
+    rows = data.iter_table(args.table, order_by=args.order_by or DUMP_TABLES[args.table])
+    count = write_rows(rows, args.format)
+    print(f"Dumped {count} rows from {args.table}", file=sys.stderr)
+
+def _db_connect(args):
+    import nextbest_migrate
+
+    try:
+        return nextbest_migrate.connect(args.database_url)
+    except Exception as e:
+        sys.exit(f"Error connecting to the database: {e}")
+
+def cmd_db_status(args):
+    import nextbest_migrate
+
+    with _db_connect(args) as conn:
+        write_rows(nextbest_migrate.status(conn), args.format)
+
+def cmd_db_migrate(args):
+    import nextbest_migrate
+
+    def progress(m):
+        print(f"  applying {m.version:04d}_{m.name}", file=sys.stderr)
+
+    with _db_connect(args) as conn:
+        changed = [r for r in nextbest_migrate.status(conn) if r["state"] == "changed"]
+        for r in changed:
+            print(f"Warning: {r['version']:04d}_{r['name']} was edited after it was applied", file=sys.stderr)
+        try:
+            applied = nextbest_migrate.migrate(conn, target=args.to, progress=progress)
+        except Exception as e:
+            sys.exit(f"Migration failed (rolled back): {e}")
+    print(f"Applied {len(applied)} migrations", file=sys.stderr)
+
+def cmd_db_check_plans(args):
+    import nextbest_migrate
+
+    with _db_connect(args) as conn:
+        failures = nextbest_migrate.check_plans(conn, seed=not args.no_seed)
+    for name, problems in failures.items():
+        print(f"FAIL {name}: {', '.join(problems)}", file=sys.stderr)
+    if failures:
+        sys.exit(f"{len(failures)} of {len(nextbest_migrate.HOT_QUERIES)} hot queries scan a whole table")
+    print(f"All {len(nextbest_migrate.HOT_QUERIES)} hot queries use an index", file=sys.stderr)
+
+# --------------------------
+# Argument parsing
+# --------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="nextbest", description="Next Best batch operations")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_format(p):
+        p.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+
+    # users
+    users = sub.add_parser("users", help="User management").add_subparsers(dest="action", required=True)
+    p = users.add_parser("list", help="List all users")
+    add_format(p)
+    p.set_defaults(func=cmd_users_list)
+    p = users.add_parser("create", help="Create a user")
+    p.add_argument("username")
+    p.add_argument("--password", help="Prompted for if omitted")
+    p.set_defaults(func=cmd_users_create)
+    p = users.add_parser("delete", help="Delete a user and all their data")
+    p.add_argument("username")
+    p.set_defaults(func=cmd_users_delete)
+    p = users.add_parser("passwd", help="Reset a user's password")
+    p.add_argument("username")
+    p.add_argument("--password", help="Prompted for if omitted")
+    p.set_defaults(func=cmd_users_passwd)
+
+    # items
+    items = sub.add_parser("items", help="Import and export media items").add_subparsers(dest="action", required=True)
+    p = items.add_parser("export", help="Export a user's items")
+    p.add_argument("username")
+    p.add_argument("--format", choices=["csv", "jsonl", "parquet"], default="csv")
+    p.add_argument("--output", "-o", default="-", help="File to write (default: stdout)")
+    p.set_defaults(func=cmd_items_export)
+    p = items.add_parser("import", help="Bulk import items from a .csv or .jsonl file")
+    p.add_argument("username")
+    p.add_argument("path", help="File to import, or '-' for csv on stdin")
+    p.add_argument("--batch-size", type=int, default=data.PAGE_SIZE)
+    p.add_argument("--allow-duplicates", action="store_true", help="Insert rows even if the item already exists")
+    p.set_defaults(func=cmd_items_import)
+
+    # stats
+    p = sub.add_parser("stats", help="Leaderboard stats for a user")
+    p.add_argument("username")
+    add_format(p)
+    p.set_defaults(func=cmd_stats)
+
+    # enrich
+    p = sub.add_parser("enrich", help="Fill in item metadata from their links")
+    p.add_argument("username")
+    p.set_defaults(func=cmd_enrich)
+
+    # dump
+    p = sub.add_parser("dump", help="Dump a whole table")
+    p.add_argument("table", choices=list(DUMP_TABLES))
+    p.add_argument("--order-by", default=None, help="column to page by (default: the primary key)")
+    add_format(p)
+    p.set_defaults(func=cmd_dump)
+
+    # db
+    db = sub.add_parser("db", help="Schema migrations (needs DATABASE_URL and psycopg)").add_subparsers(dest="action", required=True)
+
+    def add_database_url(p):
+        p.add_argument("--database-url", help="Postgres connection string (default: $DATABASE_URL)")
+
+    p = db.add_parser("status", help="Show applied and pending migrations")
+    add_database_url(p)
+    add_format(p)
+    p.set_defaults(func=cmd_db_status)
+    p = db.add_parser("migrate", help="Apply pending migrations")
+    add_database_url(p)
+    p.add_argument("--to", type=int, default=None, help="Stop after this version")
+    p.set_defaults(func=cmd_db_migrate)
+    p = db.add_parser("check-plans", help="Fail if a hot query falls back to a sequential scan (use a local database)")
+    add_database_url(p)
+    p.add_argument("--no-seed", action="store_true", help="Plan against the existing rows instead of synthetic ones")
+    p.set_defaults(func=cmd_db_check_plans)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Process-wide LRU cache with a byte budget.
+
+Shared by every Streamlit session in the process, so a user's library is
+loaded once no matter how many tabs they have open. Entries are sized from
+the actual object (deep memory usage for DataFrames). The least recently
+used entries are evicted once the total goes over the budget
+(NEXTBEST_CACHE_MB, default 256).
+
+Cached values are shared between sessions and must be treated as read-only.
+"""
+
+import dataclasses
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_BUDGET = int(os.environ.get("NEXTBEST_CACHE_MB") or 256) * 1024 * 1024
+
+def sizeof(value) -> int:
+    """Approximate bytes held by a cached value."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if dataclasses.is_dataclass(value):
+        return sys.getsizeof(value) + sum(sizeof(getattr(value, f.name)) for f in dataclasses.fields(value))
+    return sys.getsizeof(value)
+
+class LRUCache:
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._generations = {}          # key -> bumped on every invalidate
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader=None):
+        """
+        Return the cached value for key. On a miss, call loader() (if given),
+        cache the result and return it; otherwise return None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.get(key, 0)
+
+        if loader is None:
+            return None
+        value = loader()
+        self.put(key, value, generation)
+        return value
+
+    def put(self, key, value, generation=None):
+        """
+        Cache value under key, evicting least recently used entries as needed.
+        If generation is given and the key was invalidated since, the value is
+        stale and isn't stored.
+        """
+        size = sizeof(value)
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                return
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        """Whether key is cached; unlike get, not counted as a hit or miss."""
+        with self._lock:
+            return key in self._entries
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Per-user media libraries, keyed by user_id, plus values derived from them
+# keyed by (kind, user_id)
+library_cache = LRUCache()
+
+# A fixed set of locks shared out by key, so building one user's derived
+# values isn't duplicated by concurrent sessions, without keeping a lock for
+# every user ever seen
+LOCK_STRIPES = 256
+_stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+def user_lock(user_id) -> threading.Lock:
+    return _stripes[hash(user_id) % LOCK_STRIPES]
@@ -0,0 +1,194 @@
+"""
+Duplicate suggestion detection.
+
+Titles are reduced to a key that ignores case, accents, punctuation, "&" vs
+"and" and a leading (or trailing ", The") article, so "The Matrix",
+"matrix" and "Matrix, The" are the same suggestion. A TitleIndex maps
+(media_type_id, key) to item ids for constant-time exact lookups, and keeps
+character trigram postings per media type for near-duplicates ("Dune Part
+Two" vs "Dune: Part 2"): only items sharing trigrams with the new title are
+scored, by Jaccard similarity of their trigram sets.
+
+The app warns before adding a duplicate; bulk imports merge exact
+duplicates into the existing item (filling in blank fields) instead of
+inserting them again. The per-user index lives in the library cache, so it
+is rebuilt after any write to the user's items.
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+import nextbest_data as data
+from nextbest_cache import library_cache, sizeof
+
+ARTICLES = {"the", "a", "an"}
+NEAR_DUP_THRESHOLD = 0.6
+MAX_POSTING = 2_000     # trigrams on more items than this are too common to narrow anything down
+MERGE_FIELDS = ["creator", "link", "notes", "rating"]
+
+_TRAILING_ARTICLE = re.compile(r",\s*(the|a|an)\s*$")
+_NON_WORD = re.compile(r"[\W_]+")
+
+def title_key(title: str) -> str:
+    """Normalized form of a title; equal keys mean the same suggestion."""
+    text = unicodedata.normalize("NFKD", title or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold().strip()
+    trailing = _TRAILING_ARTICLE.search(text)
+    if trailing:
+        text = text[:trailing.start()]
+    words = _NON_WORD.sub(" ", text.replace("&", " and ")).split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+def trigrams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """(media_type_id, title key) -> item ids, plus trigram postings for near-duplicates."""
+
+    def __init__(self, items=()):
+        self.keys = defaultdict(list)       # (media_type_id, key) -> item ids
+        self.grams = defaultdict(set)       # (media_type_id, trigram) -> item ids
+        self.gram_counts = {}               # item_id -> number of trigrams
+        self.titles = {}                    # item_id -> title
+        for item_id, title, media_type_id in items:
+            self.add(item_id, title, media_type_id)
+
+    @classmethod
+    def from_frame(cls, df) -> "TitleIndex":
+        return cls(zip(df["item_id"].tolist(), df["title"].tolist(), df["media_type_id"].tolist()))
+
+    def add(self, item_id, title: str, media_type_id):
+        key = title_key(title)
+        if not key:
+            return
+        self.keys[(media_type_id, key)].append(item_id)
+        grams = trigrams(key)
+        for gram in grams:
+            self.grams[(media_type_id, gram)].add(item_id)
+        self.gram_counts[item_id] = len(grams)
+        self.titles[item_id] = title
+
+    def exact(self, title: str, media_type_id) -> list:
+        """Ids of items with the same title key and media type."""
+        return list(self.keys.get((media_type_id, title_key(title)), ()))
+
+    def similar(self, title: str, media_type_id, threshold: float = NEAR_DUP_THRESHOLD, limit: int = 5) -> list[tuple]:
+        """(item_id, similarity) of near-duplicates, best first; exact matches are left out."""
+        key = title_key(title)
+        if not key:
+            return []
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            posting = self.grams.get((media_type_id, gram), ())
+            if len(posting) <= MAX_POSTING:
+                shared.update(posting)
+        exact = set(self.keys.get((media_type_id, key), ()))
+        scored = []
+        for item_id, common in shared.items():
+            score = common / (len(grams) + self.gram_counts[item_id] - common)
+            if score >= threshold and item_id not in exact:
+                scored.append((item_id, round(score, 2)))
+        scored.sort(key=lambda s: s[1], reverse=True)
+        return scored[:limit]
+
+    def find(self, title: str, media_type_id, near: bool = True) -> dict:
+        """{"exact": [item ids], "near": [(item_id, similarity)]} for a title about to be added."""
+        return {
+            "exact": self.exact(title, media_type_id),
+            "near": self.similar(title, media_type_id) if near else [],
+        }
+
+    def __sizeof__(self):
+        # So the library cache charges for the whole index, not just the object header
+        return sizeof(self.keys) + sizeof(self.grams) + sizeof(self.gram_counts) + sizeof(self.titles)
+
+def get_title_index(user_id) -> TitleIndex:
+    """The user's title index, built from their cached library."""
+    return library_cache.get(("titles", user_id), lambda: TitleIndex.from_frame(data.load_mediaItems(user_id)))
+
+# --------------------------
+# Bulk merges
+# --------------------------
+
+def merge_fields(existing: dict, incoming: dict) -> dict:
+    """
+    Fields of incoming worth copying onto an existing duplicate: blanks get
+    filled, a rating is only taken if there isn't one, and new notes are
+    appended.
+    """
+    changes = {}
+    for field in MERGE_FIELDS:
+        new = incoming.get(field)
+        if new in (None, ""):
+            continue
+        old = existing.get(field)
+        if old in (None, ""):
+            changes[field] = new
+        elif field == "notes" and str(new) not in str(old):
+            changes[field] = f"{old}\n{new}"
+    return changes
+
+def plan_import(items: list[dict], index: TitleIndex) -> tuple[list[dict], dict, list[tuple]]:
+    """
+    Split import rows into (items to insert, {existing item_id: fields to
+    merge in}, [(row, near-duplicate item ids)]). Duplicates within the
+    import itself are folded into the first occurrence. index is updated
+    with the rows to insert, so pass one built for this import, not the
+    shared cached index.
+    """
+    inserts = []
+    merges = {}
+    near = []
+    pending = {}    # placeholder id -> row in inserts
+    for item in items:
+        matches = index.exact(item["title"], item["media_type_id"])
+        if matches:
+            target = matches[0]
+            if target in pending:
+                pending[target].update(merge_fields(pending[target], item))
+            else:
+                merges.setdefault(target, {}).update(merge_fields(merges.get(target, {}), item))
+            continue
+        similar = index.similar(item["title"], item["media_type_id"])
+        if similar:
+            near.append((item, [item_id for item_id, _ in similar]))
+        placeholder = ("new", len(inserts))
+        pending[placeholder] = item
+        inserts.append(item)
+        index.add(placeholder, item["title"], item["media_type_id"])
+    return inserts, {k: v for k, v in merges.items() if v}, near
+
+def merge_into_existing(merges: dict, user_id, batch_size: int = 500) -> int:
+    """
+    Apply {item_id: incoming fields} to existing items with merge_fields
+    semantics, reading batch_size rows at a time. Each item is updated with
+    only the fields that change, and only while they still hold the values
+    read, so an edit made in the meantime is kept rather than overwritten.
+    Returns the number of items changed.
+    """
+    ids = list(merges)
+    updated = 0
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        try:
+            res = (data.supabase.table("media_items").select(", ".join(["item_id"] + MERGE_FIELDS))
+                   .eq("user_id", user_id).in_("item_id", chunk).execute())
+            for row in res.data or []:
+                changes = merge_fields(row, merges[row["item_id"]])
+                if not changes:
+                    continue
+                query = data.supabase.table("media_items").update(changes).eq("item_id", row["item_id"]).eq("user_id", user_id)
+                for field in changes:
+                    query = query.is_(field, "null") if row[field] is None else query.eq(field, row[field])
+                updated += bool(query.execute().data)
+        except Exception as e:
+            print(f"Error merging duplicate items: {e}")
+            break
+    if updated:
+        data.invalidate_library(user_id)
+    return updated
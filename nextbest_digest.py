@@ -0,0 +1,145 @@
+"""
+Nightly per-user digest of the unrated backlog.
+
+Once a night the job runner (see nextbest_jobs) runs build_digests: one pass
+over every unrated media item, in item_id order with keyset pagination, into
+a single frame. Everything below is then computed with pandas group-bys
+rather than one query per user:
+
+    neglected_friends     every friend with unrated suggestions, with their
+                          latest one, longest-waiting first (the same
+                          ordering as the top_neglected_friend RPC, which
+                          only returns the first)
+    stale_high_priority   the OLDEST_HIGH_PRIORITY oldest unrated High items
+    backlog_by_type       unrated item count per media type
+
+Each user's result is upserted into user_digests (migrations/0007), so the
+Leaderboard and Home pages read it with a primary key lookup instead of
+scanning media_items on every visit.
+"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import nextbest_data as data
+
+OLDEST_HIGH_PRIORITY = 10
+UPSERT_BATCH = 500
+
+BACKLOG_COLUMNS = ["item_id", "user_id", "title", "media_type_id", "suggested_by", "date", "priority"]
+
+def iter_backlog(page_size: int = data.PAGE_SIZE):
+    """
+    Yield pages of every user's unrated items. Pages continue after the last
+    item_id seen, so each one is an index range scan however deep it is.
+    """
+    last_id = 0
+    while True:
+        res = (data.supabase.table("media_items")
+               .select(", ".join(BACKLOG_COLUMNS))
+               .is_("rating", "null")
+               .gt("item_id", last_id)
+               .order("item_id")
+               .limit(page_size)
+               .execute())
+        rows = res.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["item_id"]
+
+def compute_digests(backlog: pd.DataFrame, friend_names: dict, type_names: dict, user_ids) -> dict:
+    """
+    {user_id: digest row} for every user in user_ids, from a frame of all
+    unrated items (BACKLOG_COLUMNS). Users without a backlog get an empty
+    digest, so the pages can tell "nothing waiting" from "not built yet".
+    """
+    computed_at = datetime.now(timezone.utc).isoformat()
+    digests = {
+        user_id: {"user_id": user_id, "computed_at": computed_at, "backlog_total": 0,
+                  "neglected_friends": [], "stale_high_priority": [], "backlog_by_type": {}}
+        for user_id in user_ids
+    }
+    if backlog.empty:
+        return digests
+
+    backlog = backlog.copy()
+    backlog["date"] = pd.to_datetime(backlog["date"], utc=True, format="ISO8601")
+    # Object columns keep a missing name as None; a string column would hold NaN, which isn't valid JSON
+    backlog["friend_name"] = pd.Series([friend_names.get(f) for f in backlog["suggested_by"]], index=backlog.index, dtype=object)
+    backlog["media_type"] = pd.Series([type_names.get(m) for m in backlog["media_type_id"]], index=backlog.index, dtype=object)
+
+    # Neglected friends: each friend's latest unrated suggestion, oldest of those first
+    by_friend = backlog.dropna(subset=["suggested_by"]).sort_values("date", ascending=False)
+    unrated = by_friend.groupby(["user_id", "suggested_by"]).size().rename("unrated")
+    latest = by_friend.drop_duplicates(["user_id", "suggested_by"]).join(unrated, on=["user_id", "suggested_by"])
+    latest = latest.sort_values(["user_id", "date"])
+
+    # Oldest unrated High priority items
+    high = backlog[backlog["priority"] == "High"].sort_values(["user_id", "date"])
+    high = high.groupby("user_id").head(OLDEST_HIGH_PRIORITY)
+
+    by_type = backlog.groupby(["user_id", "media_type"]).size()   # items with an unknown type are left out
+    totals = backlog.groupby("user_id").size()
+
+    for user_id, group in latest.groupby("user_id"):
+        if user_id in digests:
+            digests[user_id]["neglected_friends"] = [
+                {"friend_name": r.friend_name, "latest_suggestion_date": r.date.isoformat(),
+                 "title": r.title, "media_type_id": int(r.media_type_id) if pd.notna(r.media_type_id) else None,
+                 "unrated": int(r.unrated)}
+                for r in group.itertuples()
+            ]
+    for user_id, group in high.groupby("user_id"):
+        if user_id in digests:
+            digests[user_id]["stale_high_priority"] = [
+                {"item_id": int(r.item_id), "title": r.title, "media_type": r.media_type,
+                 "friend_name": r.friend_name, "date": r.date.isoformat()}
+                for r in group.itertuples()
+            ]
+    for (user_id, media_type), count in by_type.items():
+        if user_id in digests:
+            digests[user_id]["backlog_by_type"][media_type] = int(count)
+    for user_id, total in totals.items():
+        if user_id in digests:
+            digests[user_id]["backlog_total"] = int(total)
+    return digests
+
+def build_digests(progress=None) -> int:
+    """
+    Rebuild every user's digest. progress(fraction, message) is called as
+    items are read and digests saved. Returns the number of digests written.
+    """
+    user_ids = [u["u_id"] for u in data.iter_table("users", "u_id", order_by="u_id")]
+    friend_names = {f["f_id"]: f["name"] for f in data.iter_table("friends", "f_id, name", order_by="f_id")}
+    type_names = {t["m_id"]: t["type_name"] for t in data.list_mediaTypes()}
+
+    pages = []
+    read = 0
+    for rows in iter_backlog():
+        pages.append(pd.DataFrame.from_records(rows, columns=BACKLOG_COLUMNS))
+        read += len(rows)
+        if progress:
+            progress(0.0, f"Read {read} unrated items")
+    backlog = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=BACKLOG_COLUMNS)
+
+    digests = list(compute_digests(backlog, friend_names, type_names, user_ids).values())
+    written = 0
+    for start in range(0, len(digests), UPSERT_BATCH):
+        batch = digests[start:start + UPSERT_BATCH]
+        data.supabase.table("user_digests").upsert(batch, on_conflict="user_id").execute()
+        written += len(batch)
+        if progress:
+            progress(written / len(digests), f"Saved {written}/{len(digests)} digests")
+    return written
+
+def get_digest(user_id) -> dict | None:
+    """The user's latest digest, or None if the nightly job hasn't built one yet."""
+    try:
+        res = data.supabase.table("user_digests").select("*").eq("user_id", user_id).limit(1).execute()
+        return res.data[0] if res.data else None
+    except Exception as e:
+        print(f"Error loading digest: {e}")
+        return None
@@ -0,0 +1,327 @@
+"""
+Link metadata enrichment for media items.
+
+Fetches the page behind each item's link and pulls out a title, creator
+(author / director / artist) and thumbnail URL from its <meta> tags. Fetches
+run on an asyncio event loop with a global concurrency cap and a minimum
+interval between requests to the same host. Results are kept in an on-disk
+cache keyed by the hash of the URL, so a link is only ever fetched once.
+
+Links are user input, so only http(s) URLs whose host resolves to public
+addresses are fetched, checked again on every redirect hop; loopback,
+private and link-local targets are refused.
+
+Titles and creators are written back in batches through the
+fill_item_metadata RPC (migrations/0011), which only fills fields that are
+still empty, so anything the user typed (even while the fetches ran) is
+left alone.
+
+The app calls start_enrichment(user_id) after a save, which runs the whole
+thing on a background thread and returns immediately.
+"""
+
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+import nextbest_data as data
+
+CACHE_DIR = os.path.join(data.LOCAL_DIR, "link_cache")
+MAX_CONCURRENCY = 8
+PER_HOST_INTERVAL = 1.0     # seconds between requests to the same host
+REQUEST_TIMEOUT = 10.0
+MAX_BODY_BYTES = 512 * 1024  # <meta> tags live in <head>, no need for the whole page
+RETRY_FAILED_AFTER = 24 * 60 * 60
+MAX_REDIRECTS = 5
+UPDATE_BATCH = 500
+
+# Columns written back; thumbnail_url is cached with the rest but media_items has no column for it
+WRITE_FIELDS = ("title", "creator")
+USER_AGENT = "NextBest/1.0 (+https://nextbest.streamlit.app)"
+
+TITLE_KEYS = ["og:title", "twitter:title"]
+CREATOR_KEYS = ["author", "article:author", "book:author", "books:author", "music:musician",
+                "video:director", "og:video:director", "twitter:creator"]
+THUMBNAIL_KEYS = ["og:image", "og:image:url", "twitter:image", "twitter:image:src"]
+
+# --------------------------
+# HTML parsing
+# --------------------------
+
+class _MetaParser(HTMLParser):
+    """Collects <meta> name/property -> content pairs and the <title> text."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta = {}
+        self.title = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            key = (attrs.get("property") or attrs.get("name") or "").strip().lower()
+            content = (attrs.get("content") or "").strip()
+            if key and content and key not in self.meta:
+                self.meta[key] = content
+        elif tag == "title":
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+
+    def handle_data(self, text):
+        if self._in_title:
+            self.title += text
+
+def parse_metadata(html: str) -> dict:
+    """Return {"title", "creator", "thumbnail_url"} found in an HTML document (values may be None)."""
+    parser = _MetaParser()
+    try:
+        parser.feed(html)
+    except Exception as e:
+        print(f"Error parsing link metadata: {e}")
+
+    def first(keys):
+        return next((parser.meta[k] for k in keys if parser.meta.get(k)), None)
+
+    return {
+        "title": first(TITLE_KEYS) or (parser.title.strip() or None),
+        "creator": first(CREATOR_KEYS),
+        "thumbnail_url": first(THUMBNAIL_KEYS),
+    }
+
+# --------------------------
+# On-disk cache
+# --------------------------
+
+def cache_path(url: str, cache_dir: str = CACHE_DIR) -> str:
+    digest = hashlib.sha256(url.strip().encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest[:2], digest + ".json")
+
+def cache_get(url: str, cache_dir: str = CACHE_DIR):
+    """Return the cached entry for a URL, or None. Failed fetches expire after RETRY_FAILED_AFTER."""
+    try:
+        with open(cache_path(url, cache_dir), encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("error") and time.time() - entry.get("fetched_at", 0) > RETRY_FAILED_AFTER:
+        return None
+    return entry
+
+def cache_put(url: str, entry: dict, cache_dir: str = CACHE_DIR):
+    path = cache_path(url, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)  # atomic, so readers never see half a file
+
+# --------------------------
+# Async fetching
+# --------------------------
+
+class HostRateLimiter:
+    """Spaces out requests so each host sees at most one every `interval` seconds."""
+
+    def __init__(self, interval: float = PER_HOST_INTERVAL):
+        self.interval = interval
+        self._next_slot = {}
+
+    async def wait(self, host: str):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+async def check_url(url: str, allow_hosts=()) -> str | None:
+    """
+    Why url must not be fetched, or None if it's safe: it has to be http(s)
+    and its host must resolve only to public addresses. Hosts in allow_hosts
+    skip the address check (for tests against a local server).
+    """
+    parts = urlparse(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "invalid url"
+    if parts.hostname in allow_hosts:
+        return None
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        return f"cannot resolve host: {e}"
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            return f"blocked address {address}"
+    return None
+
+async def fetch_metadata(client: httpx.AsyncClient, url: str, limiter: HostRateLimiter, allow_hosts=()) -> dict:
+    """
+    Fetch one link and return its cache entry (metadata, or an error).
+    Redirects are followed here rather than by httpx, so every hop's host
+    goes through check_url before it's requested.
+    """
+    entry = {"url": url, "fetched_at": time.time()}
+    target = url
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            error = await check_url(target, allow_hosts)
+            if error:
+                entry["error"] = error
+                return entry
+
+            await limiter.wait(urlparse(target).netloc.lower())
+            async with client.stream("GET", target) as res:
+                if res.is_redirect and "location" in res.headers:
+                    target = urljoin(str(res.url), res.headers["location"])
+                    continue
+                if res.status_code >= 400:
+                    entry["error"] = f"HTTP {res.status_code}"
+                    return entry
+                if "html" not in res.headers.get("content-type", "html"):
+                    entry.update({"title": None, "creator": None, "thumbnail_url": None})
+                    return entry
+                body = b""
+                async for chunk in res.aiter_bytes():
+                    body += chunk
+                    if len(body) >= MAX_BODY_BYTES:
+                        break
+                html = body.decode(res.encoding or "utf-8", errors="replace")
+                break
+        else:
+            entry["error"] = "too many redirects"
+            return entry
+    except httpx.HTTPError as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        return entry
+
+    entry.update(parse_metadata(html))
+    return entry
+
+async def enrich_urls(urls, cache_dir: str = CACHE_DIR, concurrency: int = MAX_CONCURRENCY,
+                      per_host_interval: float = PER_HOST_INTERVAL, transport=None, allow_hosts=()) -> dict:
+    """
+    Return {url: cache entry} for every URL, fetching only the ones that
+    aren't cached yet. `transport` is passed through to httpx and
+    `allow_hosts` to check_url (handy for tests).
+    """
+    results = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        cached = cache_get(url, cache_dir)
+        if cached is not None:
+            results[url] = cached
+        else:
+            missing.append(url)
+
+    if not missing:
+        return results
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(per_host_interval)
+
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, follow_redirects=False,
+                                 headers={"User-Agent": USER_AGENT}, transport=transport) as client:
+        async def one(url):
+            async with semaphore:
+                entry = await fetch_metadata(client, url, limiter, allow_hosts)
+            cache_put(url, entry, cache_dir)
+            results[url] = entry
+
+        await asyncio.gather(*(one(url) for url in missing))
+
+    return results
+
+# --------------------------
+# Write-back
+# --------------------------
+
+def _needs_enrichment(item: dict) -> bool:
+    if not (item.get("link") or "").strip():
+        return False
+    return any(not item.get(f) for f in WRITE_FIELDS)
+
+def build_updates(items: list[dict], results: dict) -> dict:
+    """
+    {item_id: {field: value}} for the empty fields (WRITE_FIELDS) each item
+    can fill from its link's metadata.
+    """
+    updates = {}
+    for item in items:
+        entry = results.get(item["link"].strip())
+        if not entry or entry.get("error"):
+            continue
+        fields = {f: entry[f] for f in WRITE_FIELDS if not item.get(f) and entry.get(f)}
+        if fields:
+            updates[item["item_id"]] = fields
+    return updates
+
+def enrich_user(user_id) -> int:
+    """Enrich all of a user's linked items. Returns the number of items updated."""
+    items = [i for i in data.iter_table("media_items", order_by="item_id", user_id=user_id) if _needs_enrichment(i)]
+    if not items:
+        return 0
+
+    results = asyncio.run(enrich_urls(i["link"].strip() for i in items))
+    updates = build_updates(items, results)
+
+    # The RPC fills only fields that are still empty: the user may have edited the item while the fetches ran
+    rows = [{"item_id": item_id, **fields} for item_id, fields in updates.items()]
+    updated = 0
+    for start in range(0, len(rows), UPDATE_BATCH):
+        try:
+            res = data.supabase.rpc(
+                "fill_item_metadata", {"user_id_param": user_id, "updates": rows[start:start + UPDATE_BATCH]}
+            ).execute()
+            updated += len(res.data or [])
+        except Exception as e:
+            print(f"Error writing link metadata: {e}")
+
+    if updated:
+        data.invalidate_library(user_id)
+    return updated
+
+# --------------------------
+# Background runner
+# --------------------------
+
+_running = {}
+_running_lock = threading.Lock()
+
+def start_enrichment(user_id) -> bool:
+    """
+    Enrich a user's items on a daemon thread and return right away.
+    Returns False if a run for this user is already in progress.
+    """
+    with _running_lock:
+        thread = _running.get(user_id)
+        if thread is not None and thread.is_alive():
+            return False
+
+        def run():
+            try:
+                enrich_user(user_id)
+            except Exception as e:
+                print(f"Error enriching links for user {user_id}: {e}")
+            finally:
+                with _running_lock:
+                    _running.pop(user_id, None)
+
+        thread = threading.Thread(target=run, name=f"nextbest-enrich-{user_id}", daemon=True)
+        _running[user_id] = thread
+        thread.start()
+        return True
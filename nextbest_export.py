@@ -0,0 +1,125 @@
+"""
+Per-user exports of media items as CSV, JSON Lines or Parquet.
+
+Items are read from the backend one page at a time, friend and media type
+names are filled in from the cached name maps, and each page is written out
+before the next is fetched, so only the encoded file is held, never the rows
+as well. Parquet gets one row group per page.
+
+The app hands export_items to st.download_button as a callable, so nothing
+is read or written until the user actually clicks download; Streamlit needs
+the file as bytes. The CLI streams write_export straight to disk instead.
+
+Parquet needs pyarrow, which is optional: it is imported only when a
+Parquet file is written, and the format is left out of FORMATS without it.
+"""
+
+import csv
+import importlib.util
+import io
+import json
+
+import pandas as pd
+
+import nextbest_data as data
+
+EXPORT_COLUMNS = ["item_id", "title", "media_type", "friend", "creator", "link", "notes", "priority", "rating", "date"]
+
+# format -> (file extension, mime type)
+FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "jsonl": ("jsonl", "application/x-ndjson"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+if importlib.util.find_spec("pyarrow") is None:
+    del FORMATS["parquet"]
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ("item_id", pa.int64()),
+        ("title", pa.string()),
+        ("media_type", pa.string()),
+        ("friend", pa.string()),
+        ("creator", pa.string()),
+        ("link", pa.string()),
+        ("notes", pa.string()),
+        ("priority", pa.string()),
+        ("rating", pa.int16()),
+        ("date", pa.timestamp("us", tz="UTC")),
+    ])
+
+def iter_export_rows(user_id, item_ids=None, page_size: int = data.PAGE_SIZE, **filters):
+    """
+    Yield a user's items as export rows (EXPORT_COLUMNS), in item_id order.
+    filters are equality checks passed to the backend (e.g. suggested_by=3);
+    item_ids, if given, keeps only those items.
+    """
+    friend_map, type_map = data.get_nameMaps(user_id)
+    rows = data.iter_table(
+        "media_items",
+        "item_id, title, media_type_id, creator, link, notes, suggested_by, date, priority, rating",
+        order_by="item_id",
+        page_size=page_size,
+        user_id=user_id,
+        **filters
+    )
+    for row in rows:
+        if item_ids is not None and row["item_id"] not in item_ids:
+            continue
+        row["friend"] = friend_map.get(row.pop("suggested_by"))
+        row["media_type"] = type_map.get(row.pop("media_type_id"))
+        yield row
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_export(rows, fmt: str, out, page_size: int = data.PAGE_SIZE) -> int:
+    """Write export rows to the binary file out in fmt. Returns the number of rows written."""
+    count = 0
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from None
+        schema = _parquet_schema(pa)
+        with pq.ParquetWriter(out, schema) as writer:
+            for batch in _batches(rows, page_size):
+                df = pd.DataFrame.from_records(batch, columns=EXPORT_COLUMNS)
+                df["date"] = pd.to_datetime(df["date"], utc=True, format="ISO8601")
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                count += len(batch)
+        return count
+
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    try:
+        if fmt == "jsonl":
+            for row in rows:
+                text.write(json.dumps({c: row.get(c) for c in EXPORT_COLUMNS}, default=str) + "\n")
+                count += 1
+        else:
+            writer = csv.DictWriter(text, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    finally:
+        text.flush()
+        text.detach()   # leave out open for the caller
+    return count
+
+def export_items(user_id, fmt: str = "csv", item_ids=None, **filters):
+    """
+    Export a user's items (see iter_export_rows for the filters) and return
+    the file's contents as bytes.
+    """
+    out = io.BytesIO()
+    write_export(iter_export_rows(user_id, item_ids, **filters), fmt, out)
+    return out.getvalue()
@@ -0,0 +1,123 @@
+"""
+Item history and undo, on top of the media_items change log.
+
+Every insert, update and delete of a media item is appended to
+media_item_changes by database triggers (migrations/0008), so nothing here
+has to remember to log: edits from the app, the write-behind journal, bulk
+imports and duplicate merges are all covered. An update records only the
+fields that changed, with old and new values.
+
+The nightly compact_change_log job folds changes older than COMPACT_AFTER_DAYS
+into one snapshot per item (media_item_snapshots), keeping each item's
+KEEP_RECENT newest changes as events, so an item's history is always a
+snapshot plus a short run of events rather than its whole life.
+
+Undo reverts a user's most recent changes, newest first, in one RPC. Tags
+removed by deleting an item are not restored when the delete is undone, and
+a friend or media type that no longer exists is restored as blank
+(migrations/0010).
+"""
+
+import nextbest_data as data
+
+MAX_UNDO = 20
+COMPACT_AFTER_DAYS = 30
+KEEP_RECENT = 20
+
+CHANGE_LABELS = {"insert": "Added", "update": "Edited", "delete": "Deleted"}
+
+# Fields worth showing in a history view; the rest (ids, op_id) are bookkeeping
+HISTORY_FIELDS = ["title", "media_type_id", "creator", "link", "notes", "suggested_by", "date", "priority", "rating"]
+
+def item_history(user_id, item_id) -> dict:
+    """
+    {"snapshot": compacted state or None, "events": changes after it, oldest
+    first}. Both reads are index lookups on (user_id, item_id).
+    """
+    try:
+        snapshot = (data.supabase.table("media_item_snapshots").select("*")
+                    .eq("user_id", user_id).eq("item_id", item_id).limit(1).execute())
+        events = (data.supabase.table("media_item_changes").select("*")
+                  .eq("user_id", user_id).eq("item_id", item_id).order("ts").order("change_id").execute())
+        return {"snapshot": (snapshot.data or [None])[0], "events": events.data or []}
+    except Exception as e:
+        print(f"Error loading item history: {e}")
+        return {"snapshot": None, "events": []}
+
+def replay(history: dict) -> list[dict]:
+    """
+    The item's state after each event that wasn't undone, starting from the
+    snapshot: [{"ts", "op", "changes": {field: (old, new)}, "undone", "state"}].
+    """
+    snapshot = history["snapshot"]
+    state = dict(snapshot["state"]) if snapshot and not snapshot["deleted"] else {}
+    versions = []
+    for event in history["events"]:
+        old = event.get("old_values") or {}
+        new = event.get("new_values") or {}
+        if event["op"] == "update":
+            changes = {f: (old.get(f), new.get(f)) for f in HISTORY_FIELDS if f in new}
+        elif event["op"] == "insert":
+            changes = {f: (None, new.get(f)) for f in HISTORY_FIELDS if new.get(f) is not None}
+        else:
+            changes = {}
+        if not event["undone"]:
+            state = {} if event["op"] == "delete" else {**state, **new}
+        versions.append({"ts": event["ts"], "op": event["op"], "changes": changes,
+                         "undone": event["undone"], "state": dict(state)})
+    return versions
+
+def recent_changes(user_id, limit: int = MAX_UNDO) -> list[dict]:
+    """A user's latest changes that can still be undone, newest first."""
+    try:
+        res = (data.supabase.table("media_item_changes")
+               .select("change_id, item_id, ts, op, old_values, new_values")
+               .eq("user_id", user_id).eq("undone", False)
+               .order("change_id", desc=True).limit(limit).execute())
+        return res.data or []
+    except Exception as e:
+        print(f"Error loading recent changes: {e}")
+        return []
+
+def undo_changes(user_id, n: int = 1) -> tuple[list, str | None]:
+    """
+    Revert the user's last n changes. Returns (ids of the items touched,
+    None), or ([], the error to show) if the undo failed.
+    """
+    if data.WRITE_BEHIND:
+        # Queued writes aren't in the log yet; send them first so "last" means last
+        from nextbest_journal import get_journal
+        get_journal().flush_once()
+    try:
+        res = data.supabase.rpc("undo_item_changes", {"user_id_param": user_id, "n": min(n, MAX_UNDO)}).execute()
+        # A setof scalar comes back as bare values or as {function name: value} rows
+        item_ids = [row["undo_item_changes"] if isinstance(row, dict) else row for row in res.data or []]
+    except Exception as e:
+        print(f"Error undoing changes: {e}")
+        # postgrest's APIError carries the database's message separately
+        return [], getattr(e, "message", None) or str(e)
+    data.invalidate_library(user_id)
+    return item_ids, None
+
+def compact(older_than_days: int = COMPACT_AFTER_DAYS, keep_recent: int = KEEP_RECENT) -> int:
+    """Fold old changes into snapshots. Returns the number of change rows removed."""
+    res = data.supabase.rpc(
+        "compact_item_changes", {"older_than": f"{older_than_days} days", "keep_recent": keep_recent}
+    ).execute()
+    return res.data or 0
+
+def describe_change(change: dict, titles: dict | None = None) -> str:
+    """
+    One line summary of a change, e.g. 'Rated Dune 8' or 'Edited Dune:
+    notes, priority'. titles maps item_id -> current title, for updates that
+    didn't touch the title.
+    """
+    old = change.get("old_values") or {}
+    new = change.get("new_values") or {}
+    title = new.get("title") or old.get("title") or (titles or {}).get(change["item_id"]) or f"item {change['item_id']}"
+    if change["op"] != "update":
+        return f"{CHANGE_LABELS[change['op']]} {title}"
+    fields = [f for f in HISTORY_FIELDS if f in new and f != "date"]
+    if fields == ["rating"]:
+        return f"Rated {title} {new['rating']}"
+    return f"Edited {title}: {', '.join(f.replace('_', ' ') for f in fields) or 'date'}"
@@ -0,0 +1,500 @@
+"""
+Background jobs for heavy admin and maintenance work.
+
+Jobs are rows in a local SQLite table (jobs.db under NEXTBEST_DIR), so they
+outlive Streamlit reruns and are picked up again after a restart. A
+dispatcher thread in the app process claims queued jobs and runs them in a
+small pool of worker processes (NEXTBEST_JOB_WORKERS, default 2) at a
+lower CPU priority, so they don't compete with interactive sessions.
+
+A running job reports progress into its row, which the admin page polls,
+and checks for a cancel request every time it does. Files a job produces
+(e.g. the xlsx export) are written to NEXTBEST_DIR/artifacts and kept for
+ARTIFACT_DAYS.
+
+    JOB_KINDS        kind -> function(ctx, **params) run in a worker
+    ON_DONE          kind -> function(job) run in the app process afterwards,
+                     e.g. to drop caches the worker couldn't reach
+    SCHEDULE         kind -> hour of day it is queued at automatically
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import nextbest_data as data
+
+JOBS_FILE = "jobs.db"
+ARTIFACT_DIR = os.path.join(data.LOCAL_DIR, "artifacts")
+ARTIFACT_DAYS = 7
+MAX_WORKERS = int(os.environ.get("NEXTBEST_JOB_WORKERS") or 2)
+WORKER_NICE = 10
+POLL_INTERVAL = 1.0
+PROGRESS_INTERVAL = 0.5     # seconds between progress writes
+STALE_AFTER = 60            # a running job this long without a heartbeat is treated as dead
+MAX_ATTEMPTS = 3
+
+ACTIVE = ("queued", "running")
+
+SCHEMA = """
+create table if not exists jobs (
+    id integer primary key autoincrement,
+    kind text not null,
+    params text not null,
+    status text not null default 'queued',
+    progress real not null default 0,
+    message text,
+    artifact text,
+    error text,
+    cancel_requested integer not null default 0,
+    attempts integer not null default 0,
+    created_by text,
+    created_at real not null,
+    started_at real,
+    finished_at real,
+    updated_at real not null
+);
+create index if not exists jobs_status_idx on jobs (status, id);
+create table if not exists schedule (
+    kind text primary key,
+    last_run real not null
+);
+"""
+
+class JobCancelled(Exception):
+    pass
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("pragma journal_mode=wal")
+    conn.execute("pragma synchronous=normal")
+    conn.executescript(SCHEMA)
+    return conn
+
+# --------------------------
+# Inside a worker
+# --------------------------
+
+class JobContext:
+    """What a job function gets: its id, progress reporting and cancellation."""
+
+    def __init__(self, conn: sqlite3.Connection, job_id: int):
+        self._conn = conn
+        self.job_id = job_id
+        self._last_write = 0.0
+        self.cancelled = False
+
+    def progress(self, fraction: float, message: str | None = None, force: bool = False):
+        """
+        Record progress (0..1). Writes are throttled to one per
+        PROGRESS_INTERVAL. Raises JobCancelled if the job has been cancelled.
+        """
+        now = time.time()
+        if force or now - self._last_write >= PROGRESS_INTERVAL:
+            self._last_write = now
+            self._conn.execute(
+                "update jobs set progress = ?, message = coalesce(?, message), updated_at = ? where id = ?",
+                (max(0.0, min(1.0, fraction)), message, now, self.job_id)
+            )
+            row = self._conn.execute("select cancel_requested from jobs where id = ?", (self.job_id,)).fetchone()
+            self.cancelled = bool(row and row["cancel_requested"])
+        if self.cancelled:
+            raise JobCancelled()
+
+    def artifact_path(self, extension: str) -> str:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        return os.path.join(ARTIFACT_DIR, f"job-{self.job_id}.{extension}")
+
+def _init_worker():
+    if hasattr(os, "nice"):
+        try:
+            os.nice(WORKER_NICE)
+        except OSError:
+            pass
+
+def run_job(db_path: str, job_id: int) -> str:
+    """Run one claimed job to completion in this (worker) process. Returns its final status."""
+    conn = _connect(db_path)
+    job = dict(conn.execute("select * from jobs where id = ?", (job_id,)).fetchone())
+    ctx = JobContext(conn, job_id)
+    status, message, artifact, error = "done", None, None, None
+    try:
+        result = JOB_KINDS[job["kind"]](ctx, **json.loads(job["params"])) or {}
+        message = result.get("message")
+        artifact = result.get("artifact")
+    except JobCancelled:
+        status, message = "cancelled", "Cancelled"
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    if status != "done":
+        # Don't leave a half written file behind
+        for path in glob.glob(os.path.join(ARTIFACT_DIR, f"job-{job_id}.*")):
+            os.remove(path)
+    now = time.time()
+    conn.execute(
+        "update jobs set status = ?, progress = case when ? = 'done' then 1 else progress end, "
+        "message = coalesce(?, message), artifact = ?, error = ?, finished_at = ?, updated_at = ? where id = ?",
+        (status, status, message, artifact, error, now, now, job_id)
+    )
+    conn.close()
+    return status
+
+# --------------------------
+# Job kinds
+# --------------------------
+
+EXPORT_TABLES = [("Users", "users", "u_id"), ("Friends", "friends", "f_id"),
+                 ("Media_Types", "media_types", "m_id"), ("Media_Items", "media_items", "item_id")]
+
+def export_xlsx(ctx: JobContext) -> dict:
+    """Every table, one sheet each, streamed page by page into an xlsx file."""
+    import xlsxwriter
+
+    path = ctx.artifact_path("xlsx")
+    totals = [data.count_rows(table) for _, table, _ in EXPORT_TABLES]
+    grand_total = max(sum(totals), 1)
+    done = 0
+    # constant_memory writes each row out as soon as the next one starts
+    with xlsxwriter.Workbook(path, {"constant_memory": True, "remove_timezone": True}) as workbook:
+        for (sheet_name, table, id_column), total in zip(EXPORT_TABLES, totals):
+            sheet = workbook.add_worksheet(sheet_name)
+            columns = None
+            for r, row in enumerate(data.iter_table(table, order_by=id_column), start=1):
+                if columns is None:
+                    columns = list(row)
+                    sheet.write_row(0, 0, columns)
+                sheet.write_row(r, 0, [row.get(c) if not isinstance(row.get(c), (dict, list)) else json.dumps(row.get(c))
+                                       for c in columns])
+                done += 1
+                if done % 500 == 0:
+                    ctx.progress(done / grand_total, f"Exporting {table}: {r}/{total}")
+    return {"artifact": path, "message": f"Exported {done} rows"}
+
+def delete_user_job(ctx: JobContext, u_id: int, username: str) -> dict:
+    """Cascade delete a user (resumable: rerunning picks up what's left)."""
+    def progress(table, deleted, total):
+        ctx.progress(deleted / total if total else 1.0, f"Deleting {table}: {deleted}/{total}")
+
+    ok = data.delete_user(u_id, progress=progress)
+    if ctx.cancelled:
+        raise JobCancelled()
+    if not ok:
+        raise RuntimeError("User was not fully deleted; run the job again to resume")
+    return {"message": f"Deleted user '{username}' and all their friends/media items"}
+
+def recompute_leaderboards(ctx: JobContext, user_ids: list | None = None) -> dict:
+    """Run the leaderboard RPCs for every user (or user_ids) and save the results as JSON."""
+    if user_ids is None:
+        user_ids = [u["u_id"] for u in data.iter_table("users", "u_id", order_by="u_id")]
+    path = ctx.artifact_path("json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i, user_id in enumerate(user_ids):
+            ctx.progress(i / max(len(user_ids), 1), f"User {i + 1}/{len(user_ids)}")
+            f.write(("," if i else "") + json.dumps(str(user_id)) + ":" + json.dumps(data.leaderboard_stats(user_id), default=str))
+        f.write("}")
+    return {"artifact": path, "message": f"Recomputed leaderboards for {len(user_ids)} users"}
+
+def nightly_digest(ctx: JobContext) -> dict:
+    """Rebuild every user's backlog digest (see nextbest_digest)."""
+    from nextbest_digest import build_digests
+
+    written = build_digests(progress=ctx.progress)
+    return {"message": f"Built digests for {written} users"}
+
+def compact_change_log(ctx: JobContext) -> dict:
+    """Fold old item changes into snapshots (see nextbest_history)."""
+    from nextbest_history import compact
+
+    ctx.progress(0.0, "Compacting the change log", force=True)
+    return {"message": f"Compacted {compact()} changes into snapshots"}
+
+JOB_KINDS = {
+    "export_xlsx": export_xlsx,
+    "delete_user": delete_user_job,
+    "recompute_leaderboards": recompute_leaderboards,
+    "nightly_digest": nightly_digest,
+    "compact_change_log": compact_change_log,
+}
+
+JOB_LABELS = {
+    "export_xlsx": "Export all tables",
+    "delete_user": "Delete user",
+    "recompute_leaderboards": "Recompute leaderboards",
+    "nightly_digest": "Nightly digest",
+    "compact_change_log": "Compact change log",
+}
+
+# kind -> local hour of day it is queued at, once a day
+SCHEDULE = {
+    "nightly_digest": int(os.environ.get("NEXTBEST_DIGEST_HOUR") or 3),
+    "compact_change_log": int(os.environ.get("NEXTBEST_COMPACT_HOUR") or 4),
+}
+
+def read_artifact(job: dict) -> bytes:
+    with open(job["artifact"], "rb") as f:
+        return f.read()
+
+def _after_delete_user(job: dict):
+    from nextbest_rank import invalidate_queue
+    from nextbest_tags import invalidate_tag_index
+    from nextbest_trends import invalidate_trends
+
+    u_id = job["params"]["u_id"]
+    data.invalidate_library(u_id)
+    invalidate_queue(u_id)
+    invalidate_trends(u_id)
+    invalidate_tag_index(u_id)
+
+def _after_recompute_leaderboards(job: dict):
+    # Refresh only the users this process already has cached: loading everyone
+    # would evict the live working set, and a user whose cache was invalidated
+    # since has written after these stats were computed
+    from nextbest_cache import library_cache
+
+    if job["status"] != "done" or not job["artifact"]:
+        return
+    with open(job["artifact"], encoding="utf-8") as f:
+        for user_id, stats in json.load(f).items():
+            key = ("leaderboard", int(user_id))
+            if key in library_cache:
+                library_cache.put(key, stats)
+
+ON_DONE = {
+    "delete_user": _after_delete_user,
+    "recompute_leaderboards": _after_recompute_leaderboards,
+}
+
+# --------------------------
+# Queue and dispatcher (app process)
+# --------------------------
+
+class JobRunner:
+    def __init__(self, path: str, max_workers: int = MAX_WORKERS):
+        self.path = path
+        self.max_workers = max_workers
+        self._conn = _connect(path)
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._running = {}      # job id -> future
+        self._pool = None
+        self._dispatcher = None
+
+    def submit(self, kind: str, params: dict | None = None, created_by: str | None = None) -> int:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "insert into jobs (kind, params, created_by, created_at, updated_at) values (?, ?, ?, ?, ?)",
+                (kind, json.dumps(params or {}), created_by, now, now)
+            )
+        self._wake.set()
+        return cur.lastrowid
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("select * from jobs where id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def list_jobs(self, limit: int = 20, kind: str | None = None) -> list[dict]:
+        query, params = "select * from jobs", []
+        if kind:
+            query += " where kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._conn.execute(query + " order by id desc limit ?", params + [limit]).fetchall()
+        return [self._decode(r) for r in rows]
+
+    def cancel(self, job_id: int):
+        """Cancel a queued job now, or ask a running one to stop at its next progress report."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "update jobs set status = 'cancelled', message = 'Cancelled', finished_at = ?, updated_at = ? "
+                "where id = ? and status = 'queued'", (now, now, job_id)
+            )
+            self._conn.execute("update jobs set cancel_requested = 1 where id = ? and status = 'running'", (job_id,))
+
+    @staticmethod
+    def _decode(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    # --------------------------
+    # Dispatching
+    # --------------------------
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._recover()
+            self._cleanup_artifacts()
+            self._pool = self._new_pool()
+            self._dispatcher = threading.Thread(target=self._run, name="nextbest-jobs", daemon=True)
+            self._dispatcher.start()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn, not fork: the app process has threads (Streamlit, journal, prefetch)
+        return ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    def _recover(self):
+        """
+        Requeue jobs left 'running' by a process that died, up to MAX_ATTEMPTS.
+        Runs on every dispatch pass, since a job interrupted by a restart only
+        goes stale STALE_AFTER seconds later; this runner's own jobs are skipped.
+        """
+        cutoff = time.time() - STALE_AFTER
+        ids = list(self._running)
+        own = f" and id not in ({','.join('?' * len(ids))})" if ids else ""
+        with self._lock:
+            self._conn.execute(
+                "update jobs set status = 'failed', error = 'Interrupted too many times', finished_at = updated_at "
+                "where status = 'running' and updated_at < ? and attempts >= ?" + own, [cutoff, MAX_ATTEMPTS] + ids
+            )
+            self._conn.execute(
+                "update jobs set status = 'queued', message = 'Restarted after an interruption' "
+                "where status = 'running' and updated_at < ?" + own, [cutoff] + ids
+            )
+
+    def _cleanup_artifacts(self):
+        if not os.path.isdir(ARTIFACT_DIR):
+            return
+        cutoff = time.time() - ARTIFACT_DAYS * 24 * 60 * 60
+        for name in os.listdir(ARTIFACT_DIR):
+            path = os.path.join(ARTIFACT_DIR, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def _schedule(self, now: datetime | None = None):
+        """
+        Queue each SCHEDULE job whose time of day has passed since it was
+        last queued. A kind that has never run starts counting from now, so
+        a fresh jobs.db waits for the next scheduled hour rather than running
+        everything at startup. Claiming the run and queueing the job is one
+        transaction, so app processes sharing jobs.db never queue it twice.
+        """
+        now = now or datetime.now()
+        for kind, hour in SCHEDULE.items():
+            due = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if due > now:
+                due -= timedelta(days=1)
+            ts = time.time()
+            with self._lock:
+                self._conn.execute("begin immediate")
+                try:
+                    # Older jobs.db files have no schedule rows: carry on from their last job
+                    self._conn.execute(
+                        "insert or ignore into schedule (kind, last_run) "
+                        "select ?, coalesce((select max(created_at) from jobs where kind = ?), ?)",
+                        (kind, kind, now.timestamp())
+                    )
+                    cur = self._conn.execute(
+                        "update schedule set last_run = ? where kind = ? and last_run < ?",
+                        (now.timestamp(), kind, due.timestamp())
+                    )
+                    if cur.rowcount:
+                        self._conn.execute(
+                            "insert into jobs (kind, params, created_by, created_at, updated_at) "
+                            "values (?, '{}', 'schedule', ?, ?)",
+                            (kind, ts, ts)
+                        )
+                    self._conn.execute("commit")
+                except Exception:
+                    self._conn.execute("rollback")
+                    raise
+
+    def _claim(self) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("select id from jobs where status = 'queued' order by id limit 1").fetchone()
+            if row is None:
+                return None
+            cur = self._conn.execute(
+                "update jobs set status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ? "
+                "where id = ? and status = 'queued'", (now, now, row["id"])
+            )
+            return self.get(row["id"]) if cur.rowcount else None
+
+    def _run(self):
+        while True:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self._reap()
+                self._recover()
+                self._schedule()
+                while len(self._running) < self.max_workers:
+                    job = self._claim()
+                    if job is None:
+                        break
+                    self._running[job["id"]] = self._pool.submit(run_job, self.path, job["id"])
+                self._heartbeat()
+            except Exception as e:
+                print(f"Error dispatching jobs: {e}")
+
+    def _heartbeat(self):
+        # Jobs between progress reports are still alive as long as their future is
+        if self._running:
+            ids = list(self._running)
+            with self._lock:
+                self._conn.execute(
+                    f"update jobs set updated_at = ? where status = 'running' and id in ({','.join('?' * len(ids))})",
+                    [time.time()] + ids
+                )
+
+    def _reap(self):
+        broken = False
+        for job_id, future in list(self._running.items()):
+            if not future.done():
+                continue
+            del self._running[job_id]
+            error = future.exception()
+            if error is not None:
+                # The worker process itself died; record it so the job isn't stuck as running
+                now = time.time()
+                with self._lock:
+                    self._conn.execute(
+                        "update jobs set status = 'failed', error = ?, finished_at = ?, updated_at = ? where id = ?",
+                        (f"{type(error).__name__}: {error}", now, now, job_id)
+                    )
+                broken = broken or isinstance(error, BrokenProcessPool)
+            job = self.get(job_id)
+            hook = ON_DONE.get(job["kind"])
+            if hook:
+                try:
+                    hook(job)
+                except Exception as e:
+                    print(f"Error finishing job {job_id}: {e}")
+        if broken:
+            # A pool that lost a worker refuses new work, so start a fresh one
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+
+# --------------------------
+# Shared instance
+# --------------------------
+
+_runner = None
+_runner_lock = threading.Lock()
+
+def get_runner() -> JobRunner:
+    """The process-wide job runner, with its dispatcher running."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(os.path.join(data.LOCAL_DIR, JOBS_FILE))
+            _runner.start()
+        return _runner
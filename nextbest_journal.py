@@ -0,0 +1,420 @@
+"""
+Write-behind journal for non-blocking saves.
+
+With NEXTBEST_WRITE_BEHIND=1 the data layer doesn't write to Supabase
+inline. add/update/delete of items, rating saves and new friends are
+appended to a local SQLite journal (WAL mode, so appends are durable and
+cheap) and the call returns straight away. Until an entry is flushed, the
+library and friend list are read with pending entries applied on top
+(see overlay_items / overlay_friends), so the user sees their change at
+once.
+
+A background worker flushes pending entries in journal order. Consecutive
+entries of the same kind are sent as one batch:
+
+    add_friend   upsert on (user_id, name), one row per name
+    add_item     upsert on op_id (migrations/0006_write_behind.sql), so a replay never duplicates
+    update_item  read current rows, check for conflicts, then update only the
+                 edited fields, guarded on the values read
+    delete_item  one delete per user by item id
+
+New rows get a negative temporary id (-journal id) until they are flushed.
+The id_map table translates it for any later entry that refers to it.
+
+An update records the values the user saw next to the values they wrote.
+If the server value of a field has since changed to something else, the
+entry is marked 'conflict' instead of overwriting it.
+
+If a batch fails, its entries are retried one at a time so a bad entry
+only fails itself. A failed entry is retried after RETRY_DELAY, doubling
+each time, and its user's later entries wait behind it; after MAX_ATTEMPTS
+it is marked 'failed'. Conflicts and failures can be retried or discarded
+from the User Options page.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+
+JOURNAL_FILE = "journal.db"
+FLUSH_INTERVAL = 2.0
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 2.0      # seconds before the first retry of a failed entry, doubled each attempt
+MAX_RETRY_DELAY = 300.0
+
+SCHEMA = """
+create table if not exists journal (
+    id integer primary key autoincrement,
+    op_id text not null unique,
+    user_id integer not null,
+    action text not null,
+    target_id integer,
+    payload text not null,
+    base text,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    error text,
+    created_at text not null,
+    flushed_at text,
+    retry_at real
+);
+create index if not exists journal_status_idx on journal (status, id);
+create index if not exists journal_user_idx on journal (user_id, status, id);
+create table if not exists id_map (
+    temp_id integer primary key,
+    real_id integer not null
+);
+"""
+
+class Conflict(Exception):
+    pass
+
+class Journal:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._worker = None
+        with self._lock:
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute("pragma synchronous=normal")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("pragma table_info(journal)")}
+            if "retry_at" not in columns:
+                # Journals written before retries backed off
+                self._conn.execute("alter table journal add column retry_at real")
+
+    # --------------------------
+    # Appending and reading
+    # --------------------------
+
+    def append(self, user_id, action: str, payload: dict, target_id=None, base: dict | None = None) -> int:
+        """Record a write and return its temporary id (negative journal id)."""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            cur = self._conn.execute(
+                "insert into journal (op_id, user_id, action, target_id, payload, base, created_at) values (?, ?, ?, ?, ?, ?, ?)",
+                (str(uuid.uuid4()), user_id, action, target_id, json.dumps(payload, default=str),
+                 json.dumps(base, default=str) if base is not None else None, now)
+            )
+            temp_id = -cur.lastrowid
+        self._wake.set()
+        return temp_id
+
+    def entries(self, user_id=None, statuses=("pending",), limit: int | None = None, due: bool = False) -> list[dict]:
+        """
+        Journal entries in order. With due=True, leaves out every user who has
+        an entry still waiting out its retry delay, so their writes stay in order.
+        """
+        query = f"select * from journal where status in ({','.join('?' * len(statuses))})"
+        params = list(statuses)
+        if user_id is not None:
+            query += " and user_id = ?"
+            params.append(user_id)
+        if due:
+            query += " and user_id not in (select user_id from journal where status = 'pending' and retry_at > ?)"
+            params.append(time.time())
+        query += " order by id"
+        if limit:
+            query += f" limit {int(limit)}"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        out = []
+        for row in rows:
+            entry = dict(row)
+            entry["payload"] = json.loads(entry["payload"])
+            entry["base"] = json.loads(entry["base"]) if entry["base"] else None
+            out.append(entry)
+        return out
+
+    def counts(self, user_id=None) -> dict:
+        query = "select status, count(*) from journal"
+        params = []
+        if user_id is not None:
+            query += " where user_id = ?"
+            params.append(user_id)
+        with self._lock:
+            return dict(self._conn.execute(query + " group by status", params).fetchall())
+
+    def retry(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("update journal set status = 'pending', attempts = 0, error = null, retry_at = null where id = ?", (entry_id,))
+        self._wake.set()
+
+    def discard(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("update journal set status = 'discarded' where id = ?", (entry_id,))
+
+    def resolve(self, target_id):
+        """Real id for a temporary id, once the entry that created it has been flushed."""
+        if target_id is None or target_id >= 0:
+            return target_id
+        with self._lock:
+            row = self._conn.execute("select real_id from id_map where temp_id = ?", (target_id,)).fetchone()
+        return row[0] if row else target_id
+
+    def _map_ids(self, pairs):
+        with self._lock:
+            self._conn.executemany("insert or replace into id_map (temp_id, real_id) values (?, ?)", pairs)
+
+    def _mark(self, entries, status: str, error: str | None = None):
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "update journal set status = ?, error = ?, attempts = attempts + 1, flushed_at = ? where id = ?",
+                [(status, error, now, e["id"]) for e in entries]
+            )
+
+    def _retry_later(self, entry, error: str):
+        """Count a failed attempt: back off exponentially, give up after MAX_ATTEMPTS."""
+        attempts = entry["attempts"] + 1
+        status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+        retry_at = time.time() + min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        with self._lock:
+            self._conn.execute(
+                "update journal set status = ?, error = ?, attempts = ?, retry_at = ? where id = ?",
+                (status, error, attempts, retry_at, entry["id"])
+            )
+
+    # --------------------------
+    # Flushing
+    # --------------------------
+
+    def flush_once(self) -> int:
+        """Flush up to BATCH_SIZE due entries. Returns how many were written."""
+        import nextbest_data as data
+        from nextbest_rank import invalidate_queue
+        from nextbest_trends import invalidate_trends
+
+        entries = self.entries(limit=BATCH_SIZE, due=True)
+        if not entries:
+            return 0
+
+        # Consecutive entries of the same kind go out as one batch; order between kinds is kept
+        runs = []
+        for entry in entries:
+            if runs and runs[-1][0]["action"] == entry["action"]:
+                runs[-1].append(entry)
+            else:
+                runs.append([entry])
+
+        flushed = 0
+        blocked = set()   # users with a failed entry: their later entries wait for it
+        for run in runs:
+            run = [e for e in run if e["user_id"] not in blocked]
+            if not run:
+                continue
+            handler = getattr(self, f"_flush_{run[0]['action']}")
+            try:
+                handler(data, run)
+                flushed += len(run)
+            except Exception as e:
+                if len(run) == 1:
+                    self._retry_later(run[0], str(e))
+                    blocked.add(run[0]["user_id"])
+                    continue
+                # Send the batch one entry at a time so a bad entry only fails itself
+                for entry in run:
+                    if entry["user_id"] in blocked:
+                        continue
+                    try:
+                        handler(data, [entry])
+                        flushed += 1
+                    except Exception as e:
+                        self._retry_later(entry, str(e))
+                        blocked.add(entry["user_id"])
+            finally:
+                for user_id in {e["user_id"] for e in run}:
+                    data.invalidate_library(user_id)
+                    if run[0]["action"] != "add_friend":
+                        # The queue and trends were built from the overlay, with temporary ids
+                        invalidate_queue(user_id)
+                        invalidate_trends(user_id)
+        return flushed
+
+    def _flush_add_friend(self, data, run):
+        # One row per name: an upsert can't touch the same row twice in one statement
+        rows = list({(e["user_id"], e["payload"]["name"]): {"name": e["payload"]["name"], "user_id": e["user_id"]}
+                     for e in run}.values())
+        res = data.supabase.table("friends").upsert(rows, on_conflict="user_id,name").execute()
+        ids = {(r["user_id"], r["name"]): r["f_id"] for r in res.data or []}
+        self._map_ids([(-e["id"], ids[(e["user_id"], e["payload"]["name"])]) for e in run if (e["user_id"], e["payload"]["name"]) in ids])
+        self._mark(run, "done")
+
+    def _flush_add_item(self, data, run):
+        rows = []
+        for e in run:
+            row = {k: v for k, v in e["payload"].items() if k != "tags"}
+            row["suggested_by"] = self.resolve(row["suggested_by"])
+            row["user_id"] = e["user_id"]
+            row["op_id"] = e["op_id"]
+            rows.append(row)
+        res = data.supabase.table("media_items").upsert(rows, on_conflict="op_id").execute()
+        ids = {r["op_id"]: r["item_id"] for r in res.data or []}
+        self._map_ids([(-e["id"], ids[e["op_id"]]) for e in run if e["op_id"] in ids])
+        for e in run:
+            if e["payload"].get("tags") and e["op_id"] in ids:
+                data.set_item_tags(ids[e["op_id"]], e["user_id"], e["payload"]["tags"])
+        self._mark(run, "done")
+
+    def _flush_update_item(self, data, run):
+        ids = {e["user_id"]: set() for e in run}
+        for e in run:
+            ids[e["user_id"]].add(self.resolve(e["target_id"]))
+        current = {}
+        for user_id, item_ids in ids.items():
+            res = data.supabase.table("media_items").select("*").eq("user_id", user_id).in_("item_id", list(item_ids)).execute()
+            current.update({r["item_id"]: r for r in res.data or []})
+
+        changes, applied, conflicts = {}, {}, []
+        for e in run:
+            item_id = self.resolve(e["target_id"])
+            payload = self._resolve_friend(e["payload"])
+            base = self._resolve_friend(e["base"] or {})
+            row = current.get(item_id)
+            try:
+                if row is None:
+                    raise Conflict("item no longer exists")
+                row = {**row, **changes.get(item_id, {})}
+                for field, value in payload.items():
+                    seen = base.get(field, row[field])
+                    if field != "date" and row[field] != seen and row[field] != value:
+                        raise Conflict(f"{field} was changed elsewhere to {row[field]!r}")
+                changes.setdefault(item_id, {}).update(payload)
+                applied.setdefault(item_id, []).append(e)
+            except Conflict as c:
+                conflicts.append((e, str(c)))
+
+        # Write only the edited fields, and only while they still hold the values read
+        for item_id, fields in changes.items():
+            row = current[item_id]
+            query = data.supabase.table("media_items").update(fields).eq("item_id", item_id).eq("user_id", row["user_id"])
+            for field in fields:
+                query = query.is_(field, "null") if row[field] is None else query.eq(field, row[field])
+            if query.execute().data:
+                self._mark(applied[item_id], "done")
+            else:
+                conflicts.extend((e, "item was changed elsewhere while saving") for e in applied[item_id])
+        for e, reason in conflicts:
+            self._mark([e], "conflict", reason)
+
+    def _resolve_friend(self, fields: dict) -> dict:
+        if fields.get("suggested_by") is None:
+            return fields
+        return {**fields, "suggested_by": self.resolve(fields["suggested_by"])}
+
+    def _flush_delete_item(self, data, run):
+        by_user = {}
+        for e in run:
+            by_user.setdefault(e["user_id"], []).append(self.resolve(e["target_id"]))
+        for user_id, item_ids in by_user.items():
+            data.supabase.table("media_items").delete().eq("user_id", user_id).in_("item_id", item_ids).execute()
+        self._mark(run, "done")
+
+    # --------------------------
+    # Background worker
+    # --------------------------
+
+    def start_worker(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+
+            def run():
+                while True:
+                    self._wake.wait(FLUSH_INTERVAL)
+                    self._wake.clear()
+                    try:
+                        while self.flush_once() == BATCH_SIZE:
+                            pass
+                    except Exception as e:
+                        print(f"Error flushing write journal: {e}")
+
+            self._worker = threading.Thread(target=run, name="nextbest-journal", daemon=True)
+            self._worker.start()
+
+    # --------------------------
+    # Overlay for reads
+    # --------------------------
+
+    def overlay_friends(self, user_id, friends: list[dict]) -> list[dict]:
+        """Friend list with not-yet-flushed new friends added (with temporary ids)."""
+        names = {f["name"] for f in friends}
+        extra = []
+        for e in self.entries(user_id, ("pending",)):
+            if e["action"] == "add_friend" and e["payload"]["name"] not in names:
+                names.add(e["payload"]["name"])
+                extra.append({"f_id": -e["id"], "name": e["payload"]["name"]})
+        return friends + extra
+
+    def overlay_items(self, user_id, frame: pd.DataFrame, friend_map: dict, type_map: dict, entries=None) -> pd.DataFrame:
+        """
+        A copy of an items frame with the user's pending adds, edits and
+        deletes applied. Pass entries read *before* the frame was loaded, so
+        an entry flushed in between shows up in one or the other; adds that
+        already reached the frame are recognized by op_id and not repeated.
+        friend_map and type_map are the user's name maps (data.get_nameMaps).
+        """
+        import nextbest_data as data
+
+        if entries is None:
+            entries = self.entries(user_id, ("pending",))
+        entries = [e for e in entries if e["action"] != "add_friend"]
+        if not entries:
+            return frame
+
+        # Work on plain object columns for the names, then re-categorize at the end,
+        # since pending rows can refer to friends the cached frame has never seen
+        frame = frame.astype({"friend": object, "media_type": object})
+
+        flushed = set(frame["op_id"].dropna()) if "op_id" in frame.columns else set()
+        added = [
+            {**{k: v for k, v in e["payload"].items() if k != "tags"}, "item_id": -e["id"], "user_id": user_id}
+            for e in entries if e["action"] == "add_item" and e["op_id"] not in flushed
+        ]
+        if added:
+            friends = [{"f_id": f_id, "name": name} for f_id, name in friend_map.items()]
+            media_types = [{"m_id": m_id, "type_name": name} for m_id, name in type_map.items()]
+            new = data.build_mediaItemsFrame(added, friends, media_types).astype({"friend": object, "media_type": object})
+            frame = pd.concat([frame, new], ignore_index=True)
+
+        for e in entries:
+            target = self.resolve(e["target_id"])
+            if e["action"] == "delete_item":
+                frame = frame[frame["item_id"] != target]
+            elif e["action"] == "update_item":
+                mask = frame["item_id"] == target
+                for field, value in e["payload"].items():
+                    if field == "date":
+                        value = pd.Timestamp(value)
+                    frame.loc[mask, field] = value
+                if "suggested_by" in e["payload"]:
+                    frame.loc[mask, "friend"] = friend_map.get(e["payload"]["suggested_by"])
+                if "media_type_id" in e["payload"]:
+                    frame.loc[mask, "media_type"] = type_map.get(e["payload"]["media_type_id"])
+
+        frame["friend"] = pd.Categorical(frame["friend"], categories=sorted(set(friend_map.values())))
+        frame["media_type"] = pd.Categorical(frame["media_type"], categories=sorted(set(type_map.values())))
+        return frame
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal() -> Journal:
+    """The process-wide journal, with its flush worker running."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            import nextbest_data as data
+            _journal = Journal(os.path.join(data.LOCAL_DIR, JOURNAL_FILE))
+            _journal.start_worker()
+        return _journal
@@ -0,0 +1,156 @@
+"""
+Per-user write rate limits and quotas.
+
+Rate limits are token buckets keyed by (who, action): each bucket holds up
+to `capacity` tokens, refills at `refill_per_sec`, and every write takes one.
+Normal use never notices; a session hammering the save button runs dry.
+
+Two implementations share one interface:
+
+    MemoryRateLimiter    buckets in this process (default, single replica)
+    SupabaseRateLimiter  buckets in the database via the take_rate_limit_token
+                         RPC (migrations/0004_rate_limits.sql), shared by
+                         every replica
+
+Set NEXTBEST_RATE_LIMITER=supabase to use the shared one. Quotas cap how
+many items and friends one user can own (NEXTBEST_MAX_ITEMS,
+NEXTBEST_MAX_FRIENDS). Both keep counters for the admin page.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+
+import nextbest_data as data
+
+# action -> (capacity, refill_per_sec)
+RATE_LIMITS = {
+    "add_item": (30, 0.5),           # bursts of 30, then one every 2s
+    "update_item": (60, 1.0),
+    "add_friend": (10, 0.1),
+    "create_user": (3, 1 / 600),     # per client address
+}
+
+QUOTAS = {
+    "media_items": int(os.environ.get("NEXTBEST_MAX_ITEMS") or 20_000),
+    "friends": int(os.environ.get("NEXTBEST_MAX_FRIENDS") or 1_000),
+}
+
+MAX_MEMORY_BUCKETS = 10_000
+
+class MemoryRateLimiter:
+    """Token buckets held in a dict in this process."""
+
+    def __init__(self, limits: dict = RATE_LIMITS):
+        self.limits = limits
+        self._buckets = {}   # key -> (tokens, last_refill)
+        self._lock = threading.Lock()
+        self.counters = defaultdict(lambda: {"allowed": 0, "denied": 0, "errors": 0})
+
+    def allow(self, who, action: str, cost: float = 1) -> bool:
+        capacity, refill = self.limits[action]
+        key = f"{action}:{who}"
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._prune(now)
+            self.counters[action]["allowed" if allowed else "denied"] += 1
+        return allowed
+
+    def _prune(self, now: float):
+        # A bucket that has refilled to capacity is the same as no bucket
+        for key, (tokens, last) in list(self._buckets.items()):
+            capacity, refill = self.limits[key.split(":", 1)[0]]
+            if tokens + (now - last) * refill >= capacity:
+                del self._buckets[key]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"buckets": len(self._buckets), "actions": {a: dict(c) for a, c in self.counters.items()}}
+
+class SupabaseRateLimiter(MemoryRateLimiter):
+    """
+    Token buckets stored in the database so every replica shares them.
+    If the RPC fails the write is allowed (and counted as an error), so a
+    database hiccup never locks everyone out.
+    """
+
+    def allow(self, who, action: str, cost: float = 1) -> bool:
+        capacity, refill = self.limits[action]
+        try:
+            res = data.supabase.rpc("take_rate_limit_token", {
+                "bucket_key_param": f"{action}:{who}",
+                "capacity": capacity,
+                "refill_per_sec": refill,
+                "cost": cost
+            }).execute()
+            allowed = bool(res.data)
+            outcome = "allowed" if allowed else "denied"
+        except Exception as e:
+            print(f"Error checking rate limit: {e}")
+            allowed, outcome = True, "errors"
+        with self._lock:
+            self.counters[action][outcome] += 1
+        return allowed
+
+    def metrics(self) -> dict:
+        # The buckets live in rate_limit_buckets, not self._buckets
+        with self._lock:
+            return {"actions": {a: dict(c) for a, c in self.counters.items()}}
+
+# --------------------------
+# Quotas
+# --------------------------
+
+_quota_counters = defaultdict(int)
+_quota_lock = threading.Lock()
+
+def within_quota(user_id, table: str, adding: int = 1) -> bool:
+    """True if the user can add `adding` more rows to table without going over their quota."""
+    used = data.count_rows(table, user_id=user_id)
+    ok = used + adding <= QUOTAS[table]
+    if not ok:
+        with _quota_lock:
+            _quota_counters[table] += 1
+    return ok
+
+# --------------------------
+# Shared instance
+# --------------------------
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter() -> MemoryRateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            shared = os.environ.get("NEXTBEST_RATE_LIMITER", "memory").lower() == "supabase"
+            _limiter = SupabaseRateLimiter() if shared else MemoryRateLimiter()
+        return _limiter
+
+def check_write(who, action: str, user_id=None, table: str | None = None):
+    """
+    Check the rate limit for an action and, if table is given, the user's
+    quota for it. Returns an error message to show, or None if the write
+    can go ahead.
+    """
+    if not get_limiter().allow(who, action):
+        return "You're doing that too quickly. Please wait a moment and try again."
+    if table is not None and user_id is not None and not within_quota(user_id, table):
+        return f"You've reached the limit of {QUOTAS[table]:,} {table.replace('_', ' ')}."
+    return None
+
+def limiter_metrics() -> dict:
+    metrics = get_limiter().metrics()
+    metrics["implementation"] = type(get_limiter()).__name__
+    with _quota_lock:
+        metrics["quota_denials"] = dict(_quota_counters)
+    return metrics
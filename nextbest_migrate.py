@@ -0,0 +1,254 @@
+"""
+Versioned schema migrations and query plan checks.
+
+Migrations are the numbered files in migrations/ (0001_schema.sql,
+0002_indexes.sql, ...), applied in order, each in its own transaction, and
+recorded in a schema_migrations table with a checksum so an edited file is
+noticed. They talk to Postgres directly (DATABASE_URL, e.g. the Supabase
+connection string), since DDL can't go through the REST API.
+
+check_plans() loads a few thousand users' worth of synthetic rows (in a
+transaction that is rolled back) and EXPLAINs the queries the app issues
+most (HOT_QUERIES). A Seq Scan in any of their plans means an index is
+missing. Point it at a local Postgres with the migrations applied.
+
+    python -m nextbest db status
+    python -m nextbest db migrate
+    python -m nextbest db check-plans
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+LOCK_ID = 4_206_913   # pg_advisory_lock key, so two deploys never migrate at once
+
+# Tables the app owns; a sequential scan on any of them fails check_plans()
+APP_TABLES = {"users", "friends", "media_types", "media_items", "tags", "item_tags", "rate_limit_buckets",
+              "user_digests", "media_item_changes", "media_item_snapshots"}
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    path: str
+
+    @property
+    def sql(self) -> str:
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+
+def load_migrations(migrations_dir: str = MIGRATIONS_DIR) -> list[Migration]:
+    """The migration files in version order. Raises ValueError on a duplicate version."""
+    migrations = {}
+    for filename in sorted(os.listdir(migrations_dir)):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version}: {filename}")
+        migrations[version] = Migration(version, match.group(2), os.path.join(migrations_dir, filename))
+    return [migrations[v] for v in sorted(migrations)]
+
+def connect(url: str | None = None):
+    """Open a Postgres connection (psycopg 3) to url or DATABASE_URL."""
+    try:
+        import psycopg
+    except ImportError:
+        raise RuntimeError("Migrations need psycopg: pip install 'psycopg[binary]'") from None
+    url = url or os.environ.get("DATABASE_URL")
+    if not url:
+        raise RuntimeError("Set DATABASE_URL (or pass --database-url) to a Postgres connection string")
+    return psycopg.connect(url, autocommit=True)
+
+# --------------------------
+# Migrating
+# --------------------------
+
+def _ensure_table(conn):
+    conn.execute("""
+        create table if not exists schema_migrations (
+            version integer primary key,
+            name text not null,
+            checksum text not null,
+            applied_at timestamptz not null default now()
+        )
+    """)
+
+def status(conn, migrations_dir: str = MIGRATIONS_DIR) -> list[dict]:
+    """
+    One row per migration file: version, name and state, which is
+    "applied", "pending", or "changed" (applied, but the file was edited since).
+    """
+    _ensure_table(conn)
+    applied = {v: c for v, c in conn.execute("select version, checksum from schema_migrations")}
+    rows = []
+    for m in load_migrations(migrations_dir):
+        if m.version not in applied:
+            state = "pending"
+        elif applied[m.version] != m.checksum:
+            state = "changed"
+        else:
+            state = "applied"
+        rows.append({"version": m.version, "name": m.name, "state": state})
+    return rows
+
+def migrate(conn, migrations_dir: str = MIGRATIONS_DIR, target: int | None = None, progress=None) -> list[Migration]:
+    """
+    Apply pending migrations up to target (default: all), each in its own
+    transaction, and return the ones applied. progress(migration) is called
+    before each. A failing migration rolls back and raises, leaving the
+    earlier ones applied, so fixing it and rerunning picks up from there.
+    """
+    _ensure_table(conn)
+    conn.execute("select pg_advisory_lock(%s)", (LOCK_ID,))
+    try:
+        done = {v for (v,) in conn.execute("select version from schema_migrations")}
+        applied = []
+        for m in load_migrations(migrations_dir):
+            if m.version in done or (target is not None and m.version > target):
+                continue
+            if progress:
+                progress(m)
+            with conn.transaction():
+                conn.execute(m.sql)
+                conn.execute(
+                    "insert into schema_migrations (version, name, checksum) values (%s, %s, %s)",
+                    (m.version, m.name, m.checksum)
+                )
+            applied.append(m)
+        return applied
+    finally:
+        conn.execute("select pg_advisory_unlock(%s)", (LOCK_ID,))
+
+# --------------------------
+# Query plan checks
+# --------------------------
+
+# Enough rows per table that the planner prefers an index for one user's
+# rows and a sequential scan when no index fits, like in production.
+SEED_SQL = """
+    insert into users (username, password_hash, salt)
+    select 'plan_check_' || g, '', '' from generate_series(1, 2000) g;
+
+    insert into friends (user_id, name)
+    select u_id, 'friend ' || g from users, generate_series(1, 10) g
+    where username like 'plan\\_check\\_%';
+
+    insert into media_items (user_id, title, media_type_id, suggested_by, date, priority, rating)
+    select f.user_id, 'item ' || g,
+           (select min(m_id) from media_types),
+           f.f_id,
+           now() - g * interval '9 days',
+           (array['High', 'Medium', 'Low'])[1 + g % 3],
+           case when g % 2 = 0 then 1 + g % 10 end
+    from friends f
+    join users u on u.u_id = f.user_id and u.username like 'plan\\_check\\_%',
+         generate_series(1, 10) g;
+
+    insert into tags (user_id, name)
+    select u_id, 'tag ' || g from users, generate_series(1, 5) g
+    where username like 'plan\\_check\\_%';
+
+    insert into item_tags (tag_id, item_id, user_id)
+    select distinct on (m.item_id) t.tag_id, m.item_id, m.user_id
+    from media_items m
+    join tags t on t.user_id = m.user_id
+    order by m.item_id, t.tag_id;
+
+    insert into user_digests (user_id)
+    select u_id from users where username like 'plan\\_check\\_%';
+
+    insert into media_item_snapshots (item_id, user_id, ts, last_change_id, state)
+    select m.item_id, m.user_id, now(), 0, '{}'
+    from media_items m
+    join users u on u.u_id = m.user_id and u.username like 'plan\\_check\\_%';
+
+    analyze;
+"""
+
+# name -> SQL, the shape of what PostgREST generates for each app query.
+# {user_id} and {friend_id} are filled in with a seeded user and one of their friends.
+HOT_QUERIES = {
+    "login": "select u_id, username, password_hash, salt, role from users where username = 'plan_check_7'",
+    "admin user search": "select u_id, username, role from users where username_lower like 'plan\\_check\\_7%' order by username_lower limit 25",
+    "list friends": "select f_id, name from friends where user_id = {user_id}",
+    "friend by name": "select f_id from friends where user_id = {user_id} and name = 'friend 3'",
+    "load library": "select * from media_items where user_id = {user_id} order by item_id limit 1000",
+    "items by friend": "select item_id from media_items where user_id = {user_id} and suggested_by = {friend_id} limit 500",
+    "items by type": "select item_id, rating from media_items where user_id = {user_id} and media_type_id = 1",
+    "unrated items": "select item_id, title from media_items where user_id = {user_id} and rating is null",
+    "trend refresh": "select date, rating, suggested_by, media_type_id from media_items "
+                     "where user_id = {user_id} and date >= now() - interval '30 days' order by item_id",
+    "journal replay": "select item_id from media_items where op_id = '00000000-0000-0000-0000-000000000000'",
+    "list tags": "select tag_id, name from tags where user_id = {user_id} order by name",
+    "item tags": "select item_id, tag_id from item_tags where user_id = {user_id} order by item_id",
+    "best ratings": "select * from top_friends_avg_rating({user_id})",
+    "most suggestions": "select * from top_friends_total_suggestions({user_id})",
+    "neglected friend": "select * from top_neglected_friend({user_id})",
+    "digest": "select * from user_digests where user_id = {user_id} limit 1",
+    "item history": "select * from media_item_changes where user_id = {user_id} and item_id = 1 order by ts, change_id",
+    "item snapshot": "select * from media_item_snapshots where user_id = {user_id} and item_id = 1 limit 1",
+    "recent changes": "select change_id, item_id, ts, op from media_item_changes "
+                      "where user_id = {user_id} and undone = false order by change_id desc limit 20",
+    "nightly backlog": "select item_id, user_id, title, media_type_id, suggested_by, date, priority from media_items "
+                       "where rating is null and item_id > 1000 order by item_id limit 1000",
+}
+
+def explain(conn, sql: str) -> dict:
+    """The planner's plan tree for sql."""
+    (plan,) = conn.execute("explain (format json) " + sql).fetchone()
+    if isinstance(plan, str):   # older servers return the JSON as text
+        import json
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+def plan_problems(plan: dict, tables=APP_TABLES, relation: str | None = None) -> list[str]:
+    """
+    Sequential scans on app tables anywhere in a plan tree, index scans
+    with no Index Cond (they walk the whole index and only filter), plus
+    function scans (an RPC that wasn't inlined would hide its own plan).
+    """
+    problems = []
+    node_type = plan.get("Node Type")
+    # A Bitmap Index Scan names only its index; the table is on the Bitmap Heap Scan above it
+    relation = plan.get("Relation Name", relation)
+    if node_type == "Seq Scan" and relation in tables:
+        problems.append(f"Seq Scan on {relation}")
+    elif node_type in INDEX_SCANS and relation in tables and "Index Cond" not in plan:
+        problems.append(f"{node_type} using {plan.get('Index Name')} on {relation} without an index condition")
+    elif node_type == "Function Scan":
+        problems.append(f"Function Scan on {plan.get('Function Name')} (not inlined)")
+    for child in plan.get("Plans", []):
+        problems.extend(plan_problems(child, tables, relation))
+    return problems
+
+def check_plans(conn, queries: dict = HOT_QUERIES, seed: bool = True) -> dict:
+    """
+    {query name: [problems]} for every hot query that falls back to a
+    sequential scan or a full index scan; empty when all pass. With seed, SEED_SQL is loaded
+    first; it runs in a transaction that is always rolled back, so the
+    database is left as it was.
+    """
+    failures = {}
+    with conn.transaction(force_rollback=True):
+        if seed:
+            conn.execute(SEED_SQL)
+        user_id, friend_id = conn.execute(
+            "select user_id, f_id from friends order by f_id desc limit 1"
+        ).fetchone() or (0, 0)
+        for name, sql in queries.items():
+            problems = plan_problems(explain(conn, sql.format(user_id=user_id, friend_id=friend_id)))
+            if problems:
+                failures[name] = problems
+    return failures
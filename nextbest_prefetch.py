@@ -0,0 +1,224 @@
+"""
+Speculative prefetch of the pages a user is likely to open next.
+
+After a page renders, the app calls after_render(user_id, page). The
+prefetcher guesses the next pages from the transitions it has seen (seeded
+with the usual Home -> All Suggestions -> Leaderboard path) and warms their
+data on a single low-priority worker thread: the user's item library and name
+maps, the leaderboard stats, the ranked queue, the trend aggregates. All of
+these already go through the app's caches, so warming one is just calling it.
+
+Navigating again cancels whatever is still queued for that user. Warmed data
+the user hasn't opened yet counts against a byte budget
+(NEXTBEST_PREFETCH_MB, default 64); once that is used up nothing more is
+warmed until some of it is visited or goes stale. Each page visit is counted
+as a hit (its data was warmed ahead of time) or a miss, so the admin page can
+show whether it pays off.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import nextbest_data as data
+from nextbest_cache import library_cache, sizeof
+
+DEFAULT_BUDGET = int(os.environ.get("NEXTBEST_PREFETCH_MB") or 64) * 1024 * 1024
+START_DELAY = 0.5       # seconds to let the current page's own fetches go first
+PREFETCH_PAGES = 2      # how many of the likeliest next pages to warm
+STALE_AFTER = 10 * 60   # warmed data not visited within this is written off
+
+# Typical navigation, used until real transitions have been seen
+PRIOR_TRANSITIONS = {
+    "Home": {"All Suggestions": 3, "What Next?": 1},
+    "All Suggestions": {"Leaderboard": 3, "Home": 1},
+    "What Next?": {"All Suggestions": 2, "Home": 1},
+    "Leaderboard": {"Home": 2, "Trends": 1},
+    "Trends": {"Leaderboard": 1, "Home": 1},
+    "User Options": {"Home": 1},
+}
+
+def _warm_library(user_id):
+    return data.get_nameMaps(user_id), data.load_mediaItems(user_id)
+
+def _warm_leaderboard(user_id):
+    return data.get_leaderboardStats(user_id)
+
+def _warm_queue(user_id):
+    from nextbest_rank import get_queue
+    return get_queue(user_id)
+
+def _warm_trends(user_id):
+    from nextbest_trends import get_trends
+    return get_trends(user_id, "month")
+
+# page -> function that loads (and caches) what the page reads first
+PAGE_WARMERS = {
+    "Home": lambda user_id: data.get_nameMaps(user_id),
+    "All Suggestions": _warm_library,
+    "What Next?": _warm_queue,
+    "Leaderboard": _warm_leaderboard,
+    "Trends": _warm_trends,
+}
+
+# page -> library_cache key its data lives under; a warmed page whose entry
+# was invalidated (by a write) or evicted since counts as a miss
+PAGE_CACHE_KEYS = {
+    "Home": lambda user_id: ("names", user_id),
+    "All Suggestions": lambda user_id: user_id,
+    "What Next?": lambda user_id: ("queue", user_id),
+    "Leaderboard": lambda user_id: ("leaderboard", user_id),
+    "Trends": lambda user_id: ("trends", user_id),
+}
+
+class Prefetcher:
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET, start_delay: float = START_DELAY):
+        self.max_bytes = max_bytes
+        self.start_delay = start_delay
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._generations = defaultdict(int)    # user_id -> bumped on every navigation
+        self._warmed = {}                       # (user_id, page) -> (bytes, warmed_at)
+        self._transitions = defaultdict(lambda: defaultdict(int))
+        self._last_page = {}                    # user_id -> page
+        self.bytes = 0
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0, "warmed": 0, "cancelled": 0,
+                                             "over_budget": 0, "stale": 0, "errors": 0})
+        self._worker = threading.Thread(target=self._run, name="nextbest-prefetch", daemon=True)
+        self._worker.start()
+
+    # --------------------------
+    # Called by the app
+    # --------------------------
+
+    def after_render(self, user_id, page: str):
+        """
+        Record a visit to page (once per navigation, not per rerun), then
+        cancel this user's queued warm-ups and queue new ones for the pages
+        likeliest to come next.
+        """
+        with self._lock:
+            previous = self._last_page.get(user_id)
+            if previous == page:
+                return
+            self._last_page[user_id] = page
+            if previous is not None:
+                self._transitions[previous][page] += 1
+            self._record_visit(user_id, page)
+            self._generations[user_id] += 1
+            generation = self._generations[user_id]
+            next_pages = self.predict(page)
+
+        for next_page in next_pages:
+            self._tasks.put((user_id, next_page, generation, time.monotonic() + self.start_delay))
+
+    def cancel(self, user_id):
+        """Drop everything queued for a user (e.g. on logout)."""
+        with self._lock:
+            self._generations[user_id] += 1
+            self._last_page.pop(user_id, None)
+            for key in [k for k in self._warmed if k[0] == user_id]:
+                self.bytes -= self._warmed.pop(key)[0]
+
+    def predict(self, page: str, n: int = PREFETCH_PAGES) -> list[str]:
+        """The n pages most often opened after page, observed counts first, then the prior."""
+        seen = self._transitions.get(page, {})
+        prior = PRIOR_TRANSITIONS.get(page, {})
+        candidates = set(seen) | set(prior)
+        ranked = sorted(candidates, key=lambda p: (seen.get(p, 0), prior.get(p, 0)), reverse=True)
+        return [p for p in ranked if p != page and p in PAGE_WARMERS][:n]
+
+    # --------------------------
+    # Bookkeeping (hold self._lock)
+    # --------------------------
+
+    def _record_visit(self, user_id, page: str):
+        if page not in PAGE_WARMERS:
+            return
+        warmed = self._warmed.pop((user_id, page), None)
+        cache_key = PAGE_CACHE_KEYS.get(page)
+        still_cached = cache_key is None or cache_key(user_id) in library_cache
+        if warmed is not None and still_cached and time.monotonic() - warmed[1] <= STALE_AFTER:
+            self.counters[page]["hits"] += 1
+        else:
+            self.counters[page]["misses"] += 1
+        if warmed is not None:
+            self.bytes -= warmed[0]
+
+    def _expire(self, now: float):
+        for key, (size, warmed_at) in list(self._warmed.items()):
+            if now - warmed_at > STALE_AFTER:
+                del self._warmed[key]
+                self.bytes -= size
+                self.counters[key[1]]["stale"] += 1
+
+    # --------------------------
+    # Worker
+    # --------------------------
+
+    def _run(self):
+        while True:
+            user_id, page, generation, not_before = self._tasks.get()
+            delay = not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._warm(user_id, page, generation)
+
+    def _warm(self, user_id, page: str, generation: int):
+        with self._lock:
+            if self._generations[user_id] != generation or self._last_page.get(user_id) == page:
+                self.counters[page]["cancelled"] += 1
+                return
+            if (user_id, page) in self._warmed:
+                return
+            self._expire(time.monotonic())
+            if self.bytes >= self.max_bytes:
+                self.counters[page]["over_budget"] += 1
+                return
+
+        try:
+            value = PAGE_WARMERS[page](user_id)
+        except Exception as e:
+            print(f"Error prefetching {page} for user {user_id}: {e}")
+            with self._lock:
+                self.counters[page]["errors"] += 1
+            return
+
+        size = sizeof(value)
+        with self._lock:
+            if self._generations[user_id] != generation:
+                # The user moved on while this ran; the data is cached anyway but isn't counted as a prefetch
+                self.counters[page]["cancelled"] += 1
+                return
+            self._warmed[(user_id, page)] = (size, time.monotonic())
+            self.bytes += size
+            self.counters[page]["warmed"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            pages = {p: dict(c) for p, c in self.counters.items()}
+            hits = sum(c["hits"] for c in pages.values())
+            visits = hits + sum(c["misses"] for c in pages.values())
+            return {
+                "pages": pages,
+                "hit_rate": hits / visits if visits else 0.0,
+                "pending": self._tasks.qsize(),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+# --------------------------
+# Shared instance
+# --------------------------
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+def get_prefetcher() -> Prefetcher:
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
@@ -0,0 +1,157 @@
+"""
+"Next best" ranking of a user's unrated suggestions.
+
+Each unrated item gets a predicted rating:
+
+    friend score   the suggesting friend's average rating, shrunk toward the
+                   user's overall mean by SHRINKAGE pseudo-ratings so a friend
+                   with one 10/10 doesn't outrank one with fifty 8/10s
+    type affinity  how much the user's ratings for this media type sit above
+                   or below their mean (shrunk the same way)
+
+and the queue is ordered by that prediction plus a bonus for priority and a
+small, capped bonus for how long the item has been waiting.
+
+Scores for the whole library are computed in one vectorized pass and kept
+per user as a sorted frame. When an item is rated the friend/type totals
+are adjusted and the frame rescored in memory, with no refetch.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import nextbest_data as data
+from nextbest_cache import library_cache, user_lock
+
+SHRINKAGE = 3.0          # pseudo-ratings at the user's mean added to every average
+DEFAULT_MEAN = 5.5       # mean used before the user has rated anything
+TYPE_WEIGHT = 0.5
+PRIORITY_POINTS = {"High": 1.0, "Medium": 0.0, "Low": -1.0}
+AGE_POINTS = 0.5         # reached after AGE_CAP_DAYS, growing logarithmically
+AGE_CAP_DAYS = 365
+
+QUEUE_COLUMNS = ["item_id", "title", "media_type_id", "media_type", "suggested_by", "priority", "date", "age_days"]
+
+@dataclass
+class RankedQueue:
+    """A user's unrated items sorted by score, plus the rating totals the scores come from."""
+    items: pd.DataFrame
+    friend_stats: pd.DataFrame   # index suggested_by, columns sum/count
+    type_stats: pd.DataFrame     # index media_type_id, columns sum/count
+    total_sum: float = 0.0
+    total_count: int = 0
+    built_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def user_mean(self) -> float:
+        return self.total_sum / self.total_count if self.total_count else DEFAULT_MEAN
+
+    def top(self, n: int = 10) -> pd.DataFrame:
+        return self.items.head(n)
+
+# --------------------------
+# Scoring
+# --------------------------
+
+def _shrunk_mean(stats: pd.DataFrame, keys: pd.Series, prior: float) -> pd.Series:
+    means = (stats["sum"] + SHRINKAGE * prior) / (stats["count"] + SHRINKAGE)
+    return keys.map(means).astype(float).fillna(prior)
+
+def score_items(queue: RankedQueue):
+    """Recompute predicted rating and score for every queued item and re-sort."""
+    items = queue.items
+    if items.empty:
+        return
+
+    mean = queue.user_mean
+    friend_score = _shrunk_mean(queue.friend_stats, items["suggested_by"], mean)
+    type_affinity = _shrunk_mean(queue.type_stats, items["media_type_id"], mean) - mean
+
+    predicted = (friend_score + TYPE_WEIGHT * type_affinity).clip(1, 10)
+    priority = items["priority"].map(PRIORITY_POINTS).astype(float).fillna(0.0)
+    age = AGE_POINTS * np.minimum(np.log1p(items["age_days"]) / np.log1p(AGE_CAP_DAYS), 1.0)
+
+    items["predicted_rating"] = predicted.round(2)
+    items["score"] = predicted + priority + age
+    queue.items = items.sort_values(["score", "item_id"], ascending=[False, True], kind="stable")
+
+def build_queue(rows: list[dict], now: datetime | None = None) -> RankedQueue:
+    """Build a ranked queue from a user's media items (as returned by list_mediaItems)."""
+    now = now or datetime.now(timezone.utc)
+    df = pd.DataFrame(rows, columns=QUEUE_COLUMNS[:-1] + ["rating"])
+
+    rated = df[df["rating"].notna()]
+    ratings = rated["rating"].astype(float)
+    friend_stats = ratings.groupby(rated["suggested_by"]).agg(["sum", "count"])
+    type_stats = ratings.groupby(rated["media_type_id"]).agg(["sum", "count"])
+
+    items = df[df["rating"].isna()].drop(columns="rating").copy()
+    dates = pd.to_datetime(items["date"], utc=True, errors="coerce", format="ISO8601")
+    items["age_days"] = ((now - dates).dt.total_seconds() / 86400).clip(lower=0).fillna(0)
+
+    queue = RankedQueue(items, friend_stats, type_stats, float(ratings.sum()), int(ratings.count()))
+    score_items(queue)
+    return queue
+
+def _adjust(stats: pd.DataFrame, key, delta_sum: float, delta_count: int):
+    if key in stats.index:
+        stats.loc[key, "sum"] += delta_sum
+        stats.loc[key, "count"] += delta_count
+    else:
+        stats.loc[key, ["sum", "count"]] = [delta_sum, delta_count]
+
+def apply_rating(queue: RankedQueue, item: dict, rating, old_rating=None):
+    """
+    Fold a rating change into the queue's totals and rescore. `item` needs
+    suggested_by and media_type_id; old_rating is the previous value, if any.
+    """
+    delta_sum = float(rating) - (float(old_rating) if old_rating is not None else 0.0)
+    delta_count = 0 if old_rating is not None else 1
+
+    _adjust(queue.friend_stats, item["suggested_by"], delta_sum, delta_count)
+    _adjust(queue.type_stats, item["media_type_id"], delta_sum, delta_count)
+    queue.total_sum += delta_sum
+    queue.total_count += delta_count
+
+    queue.items = queue.items[queue.items["item_id"] != item["item_id"]]
+    score_items(queue)
+
+# --------------------------
+# Per-user index
+# --------------------------
+
+def _key(user_id):
+    return ("queue", user_id)
+
+def get_queue(user_id) -> RankedQueue:
+    """
+    Return the user's ranked queue, building it on first use. Queues live in
+    the shared library cache, so they count against its byte budget.
+    """
+    def build():
+        if data.WRITE_BEHIND:
+            # Include writes still waiting in the journal; flushing them drops the queue
+            rows = data.mediaItems_records(data.load_mediaItems(user_id))
+        else:
+            rows = list(data.iter_mediaItems(user_id))
+        return build_queue(rows)
+
+    # Build under the user's lock so concurrent sessions don't each build it
+    with user_lock(user_id):
+        return library_cache.get(_key(user_id), build)
+
+def record_rating(user_id, item: dict, rating, old_rating=None):
+    """Update the cached queue (if any) after a rating is saved."""
+    with user_lock(user_id):
+        queue = library_cache.get(_key(user_id))
+        if queue is not None:
+            apply_rating(queue, item, rating, old_rating)
+            library_cache.put(_key(user_id), queue)   # re-sized
+
+def invalidate_queue(user_id):
+    """Drop the cached queue so the next get_queue() rebuilds it."""
+    with user_lock(user_id):
+        library_cache.invalidate(_key(user_id))
@@ -0,0 +1,114 @@
+"""
+Inverted index over a user's item tags.
+
+Each tag maps to a sorted posting list of item ids. Filtering on several
+tags intersects (match all) or merges (match any) those lists, starting
+from the shortest, instead of scanning the whole library. The facet counts
+for the result (how many matching items carry each tag) are tallied in the
+same pass.
+
+Indexes are built from item_tags in one paginated read and cached per user
+until a tag changes. The tags and item_tags tables are created by
+migrations/0005_tags.sql.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+import nextbest_data as data
+
+def parse_tags(text: str) -> list[str]:
+    """Split comma separated user input into normalized, de-duplicated tags."""
+    return list(dict.fromkeys(t for t in (data.normalize_tag(p) for p in (text or "").split(",")) if t))
+
+def intersect(a: list, b: list) -> list:
+    """Intersection of two sorted lists, galloping through the longer one."""
+    if len(a) > len(b):
+        a, b = b, a
+    out = []
+    lo = 0
+    for x in a:
+        lo = bisect_left(b, x, lo)
+        if lo == len(b):
+            break
+        if b[lo] == x:
+            out.append(x)
+    return out
+
+def union(lists: list[list]) -> list:
+    """Union of sorted lists, still sorted."""
+    out = []
+    for x in heapq.merge(*lists):
+        if not out or out[-1] != x:
+            out.append(x)
+    return out
+
+class TagIndex:
+    """tag -> sorted item ids, plus item -> tags for facet counting."""
+
+    def __init__(self, pairs=()):
+        postings = defaultdict(list)
+        item_tags = defaultdict(list)
+        for item_id, tag in pairs:
+            postings[tag].append(item_id)
+            item_tags[item_id].append(tag)
+        self.postings = {tag: sorted(set(ids)) for tag, ids in postings.items()}
+        self.item_tags = dict(item_tags)
+
+    def tags_for(self, item_id) -> list[str]:
+        return sorted(self.item_tags.get(item_id, []))
+
+    def match(self, tags: list[str], mode: str = "all") -> list:
+        """Item ids carrying all (or any) of the tags."""
+        lists = sorted((self.postings.get(t, []) for t in tags), key=len)
+        if not lists:
+            return []
+        if mode == "any":
+            return union(lists)
+        result = lists[0]
+        for posting in lists[1:]:
+            if not result:
+                break
+            result = intersect(result, posting)
+        return result
+
+    def facets(self, item_ids=None) -> dict:
+        """Tag -> number of items (among item_ids, or all items) carrying it."""
+        if item_ids is None:
+            return {tag: len(ids) for tag, ids in self.postings.items()}
+        counts = Counter()
+        for item_id in item_ids:
+            counts.update(self.item_tags.get(item_id, ()))
+        return dict(counts)
+
+    def filter(self, tags: list[str], mode: str = "all", within=None) -> tuple[list, dict]:
+        """
+        Ids matching the tag filter (optionally restricted to the sorted ids
+        in `within`) and the tag facet counts over that result.
+        """
+        ids = self.match(tags, mode) if tags else None
+        if within is not None:
+            ids = intersect(ids, within) if ids is not None else within
+        return ids, self.facets(ids)
+
+# --------------------------
+# Per-user cache
+# --------------------------
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_tag_index(user_id) -> TagIndex:
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+    if index is None:
+        index = TagIndex(data.iter_itemTags(user_id))
+        with _indexes_lock:
+            _indexes[user_id] = index
+    return index
+
+def invalidate_tag_index(user_id):
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
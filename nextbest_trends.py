@@ -0,0 +1,192 @@
+"""
+Time-windowed suggestion and rating trends.
+
+A user's items are bucketed by week and by month on their `date` and
+aggregated per friend and per media type into suggestion counts and rating
+sums. The aggregates are cached per user. A write only marks the buckets
+its date falls in as dirty, and the next read refetches and re-aggregates
+just those buckets instead of rescanning the whole history.
+
+Averages, rolling windows and rising/falling detection are all derived from
+the cached aggregates.
+"""
+
+import threading
+from datetime import timezone
+
+import numpy as np
+import pandas as pd
+
+import nextbest_data as data
+from nextbest_cache import library_cache, user_lock
+
+FREQS = {"week": "W", "month": "M"}
+DIMENSIONS = {"friend": "suggested_by", "type": "media_type_id"}
+AGG_COLUMNS = ["period", "dimension", "key", "suggestions", "rating_sum", "rated"]
+
+# --------------------------
+# Aggregation
+# --------------------------
+
+def _periods(dates: pd.Series, freq: str) -> pd.Series:
+    parsed = pd.to_datetime(dates, utc=True, errors="coerce", format="ISO8601")
+    return parsed.dt.tz_localize(None).dt.to_period(freq)
+
+def aggregate(rows, freq: str) -> pd.DataFrame:
+    """Bucket items by period and aggregate per friend and per media type."""
+    df = pd.DataFrame(list(rows), columns=["date", "rating"] + list(DIMENSIONS.values()))
+    df["period"] = _periods(df["date"], freq)
+    df = df[df["period"].notna()]
+    rating = pd.to_numeric(df["rating"], errors="coerce")
+    df = df.assign(rating_sum=rating.fillna(0), rated=rating.notna().astype(int))
+
+    frames = []
+    for dimension, column in DIMENSIONS.items():
+        grouped = (
+            df.groupby(["period", column])
+            .agg(suggestions=("rated", "size"), rating_sum=("rating_sum", "sum"), rated=("rated", "sum"))
+            .reset_index()
+            .rename(columns={column: "key"})
+        )
+        grouped.insert(1, "dimension", dimension)
+        frames.append(grouped)
+    return pd.concat(frames, ignore_index=True)[AGG_COLUMNS]
+
+def trend_table(agg: pd.DataFrame, dimension: str) -> pd.DataFrame:
+    """Per-period volume and average rating for one dimension."""
+    out = agg[agg["dimension"] == dimension].drop(columns="dimension").sort_values(["period", "key"])
+    out["avg_rating"] = (out["rating_sum"] / out["rated"].replace(0, np.nan)).round(2)
+    return out.reset_index(drop=True)
+
+def _wide(agg: pd.DataFrame, dimension: str, value: str) -> pd.DataFrame:
+    """period x key matrix of one aggregate, with empty periods filled in as 0."""
+    sub = agg[agg["dimension"] == dimension]
+    if sub.empty:
+        return pd.DataFrame()
+    wide = sub.pivot_table(index="period", columns="key", values=value, aggfunc="sum", fill_value=0)
+    full = pd.period_range(wide.index.min(), wide.index.max(), freq=wide.index.freq)
+    return wide.reindex(full, fill_value=0)
+
+def rolling(agg: pd.DataFrame, dimension: str, window: int) -> pd.DataFrame:
+    """Rolling suggestion volume and average rating over the last `window` periods, per key."""
+    suggestions = _wide(agg, dimension, "suggestions")
+    if suggestions.empty:
+        return pd.DataFrame(columns=["period", "key", "suggestions", "avg_rating"])
+    rating_sum = _wide(agg, dimension, "rating_sum").rolling(window, min_periods=1).sum()
+    rated = _wide(agg, dimension, "rated").rolling(window, min_periods=1).sum()
+
+    out = pd.DataFrame({
+        "suggestions": suggestions.rolling(window, min_periods=1).sum().stack(),
+        "avg_rating": (rating_sum / rated.replace(0, np.nan)).stack(future_stack=True).round(2),
+    })
+    out.index.names = ["period", "key"]
+    return out.reset_index()
+
+def movers(agg: pd.DataFrame, dimension: str = "friend", window: int = 3, min_rated: int = 2,
+           threshold: float = 1.0) -> pd.DataFrame:
+    """
+    Compare each key's average rating over the last `window` periods with
+    the `window` before that. Keys with at least `min_rated` ratings in both
+    windows that moved by `threshold` or more are flagged rising or falling.
+    """
+    columns = ["key", "recent_avg", "prior_avg", "change", "recent_suggestions", "prior_suggestions", "trend"]
+    rating_sum = _wide(agg, dimension, "rating_sum")
+    if len(rating_sum) < 2:
+        return pd.DataFrame(columns=columns)
+    rated = _wide(agg, dimension, "rated")
+    suggestions = _wide(agg, dimension, "suggestions")
+
+    recent, prior = slice(-window, None), slice(-2 * window, -window)
+    out = pd.DataFrame({
+        "recent_rated": rated.iloc[recent].sum(),
+        "prior_rated": rated.iloc[prior].sum(),
+        "recent_avg": rating_sum.iloc[recent].sum() / rated.iloc[recent].sum().replace(0, np.nan),
+        "prior_avg": rating_sum.iloc[prior].sum() / rated.iloc[prior].sum().replace(0, np.nan),
+        "recent_suggestions": suggestions.iloc[recent].sum(),
+        "prior_suggestions": suggestions.iloc[prior].sum(),
+    })
+    out = out[(out["recent_rated"] >= min_rated) & (out["prior_rated"] >= min_rated)]
+    out["change"] = out["recent_avg"] - out["prior_avg"]
+    out["trend"] = np.select([out["change"] >= threshold, out["change"] <= -threshold], ["rising", "falling"], "steady")
+    out = out.rename_axis("key").reset_index().round({"recent_avg": 2, "prior_avg": 2, "change": 2})
+    return out.sort_values("change", ascending=False)[columns].reset_index(drop=True)
+
+# --------------------------
+# Per-user cache
+# --------------------------
+
+# Each user's aggregates live in the shared library cache under ("trends", user_id)
+# as {"week": agg, "month": agg, "dirty": UTC timestamps written since the last read}
+_dirty_lock = threading.Lock()
+
+def _key(user_id):
+    return ("trends", user_id)
+
+def _fetch(user_id, start=None, end=None):
+    if data.WRITE_BEHIND:
+        # Aggregate the library with pending journal writes applied; flushing them drops the cache
+        frame = data.load_mediaItems(user_id)
+        if start is not None:
+            frame = frame[frame["date"] >= start]
+        if end is not None:
+            frame = frame[frame["date"] < end]
+        return data.mediaItems_records(frame[["date", "rating"] + list(DIMENSIONS.values())])
+    columns = "date, rating, " + ", ".join(DIMENSIONS.values())
+    gte = {"date": start.isoformat()} if start is not None else None
+    lt = {"date": end.isoformat()} if end is not None else None
+    return data.iter_table("media_items", columns, order_by="item_id", gte=gte, lt=lt, user_id=user_id)
+
+def _refresh_buckets(entry: dict, user_id, dirty: set) -> dict:
+    """Re-aggregate only the periods that contain a dirty timestamp."""
+    refreshed = {}
+    for name, freq in FREQS.items():
+        periods = {d.tz_convert(None).to_period(freq) for d in dirty}
+        fresh = []
+        for period in periods:
+            start = period.start_time.tz_localize(timezone.utc)
+            end = (period + 1).start_time.tz_localize(timezone.utc)
+            fresh.append(aggregate(_fetch(user_id, start, end), freq))
+        kept = entry[name][~entry[name]["period"].isin(list(periods))]
+        refreshed[name] = pd.concat([kept] + fresh, ignore_index=True)
+    return refreshed
+
+def get_trends(user_id, freq: str = "month") -> pd.DataFrame:
+    """Cached aggregates for a user at "week" or "month" granularity."""
+    def build():
+        rows = list(_fetch(user_id))
+        return {**{name: aggregate(rows, f) for name, f in FREQS.items()}, "dirty": set()}
+
+    # Build and refresh under the user's lock so concurrent sessions don't repeat the work
+    with user_lock(user_id):
+        entry = library_cache.get(_key(user_id), build)
+        with _dirty_lock:
+            dirty, entry["dirty"] = entry["dirty"], set()
+        if dirty:
+            entry = {**_refresh_buckets(entry, user_id, dirty), "dirty": entry["dirty"]}
+            library_cache.put(_key(user_id), entry)
+        return entry[freq]
+
+def touch_trends(user_id, *dates):
+    """
+    Mark the buckets containing these dates (datetimes or ISO strings) as
+    stale for a user. Pass the old and new date when an item's date moves.
+    """
+    stamps = set()
+    for d in dates:
+        try:
+            ts = pd.Timestamp(d)
+        except (ValueError, TypeError):
+            continue
+        if ts is pd.NaT:
+            continue
+        stamps.add(ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC"))
+    # Not the user's lock: a write shouldn't wait for a refresh in progress
+    entry = library_cache.get(_key(user_id))
+    if entry is not None:
+        with _dirty_lock:
+            entry["dirty"].update(stamps)
+
+def invalidate_trends(user_id):
+    """Drop a user's cached aggregates entirely (e.g. after a bulk delete)."""
+    with user_lock(user_id):
+        library_cache.invalidate(_key(user_id))
@@ -0,0 +1,42 @@
+import json
+
+import pandas as pd
+
+from nextbest_digest import BACKLOG_COLUMNS, compute_digests
+
+def backlog(rows):
+    return pd.DataFrame.from_records(rows, columns=BACKLOG_COLUMNS)
+
+def test_missing_names_are_none():
+    frame = backlog([
+        {"item_id": 1, "user_id": 7, "title": "Dune", "media_type_id": 1, "suggested_by": 3,
+         "date": "2024-01-01T00:00:00+00:00", "priority": "High"},
+        {"item_id": 2, "user_id": 7, "title": "Solaris", "media_type_id": 9, "suggested_by": None,
+         "date": "2024-02-01T00:00:00+00:00", "priority": "High"},
+    ])
+    digest = compute_digests(frame, {3: "Bob"}, {1: "Movie"}, [7, 8])[7]
+
+    stale = {r["title"]: r for r in digest["stale_high_priority"]}
+    assert stale["Solaris"]["friend_name"] is None
+    assert stale["Solaris"]["media_type"] is None
+    assert digest["backlog_by_type"] == {"Movie": 1}
+    assert digest["backlog_total"] == 2
+    assert [f["friend_name"] for f in digest["neglected_friends"]] == ["Bob"]
+    # Strict JSON, as the upsert sends it
+    json.dumps(digest, allow_nan=False)
+
+def test_missing_media_type_id_is_none():
+    frame = backlog([
+        {"item_id": 1, "user_id": 7, "title": "Dune", "media_type_id": None, "suggested_by": 3,
+         "date": "2024-01-01T00:00:00+00:00", "priority": "Low"},
+    ])
+    digest = compute_digests(frame, {3: "Bob"}, {1: "Movie"}, [7])[7]
+
+    assert digest["neglected_friends"][0]["media_type_id"] is None
+    assert digest["backlog_by_type"] == {}
+    json.dumps(digest, allow_nan=False)
+
+def test_users_without_backlog_get_empty_digest():
+    digests = compute_digests(backlog([]), {}, {}, [7])
+    assert digests[7]["backlog_total"] == 0
+    assert digests[7]["neglected_friends"] == []
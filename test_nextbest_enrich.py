@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from nextbest_enrich import build_updates, check_url, enrich_urls
+
+PAGE = b"""<html><head><title>Fallback</title>
+<meta property="og:title" content="Dune">
+<meta name="author" content="Frank Herbert">
+</head><body></body></html>"""
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path == "/hop":
+            # Same server, but by a name that isn't allowed
+            self.send_response(302)
+            self.send_header("Location", f"http://localhost:{self.server.server_port}/page")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.hits = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def fetch(urls, cache_dir, **kwargs):
+    return asyncio.run(enrich_urls(urls, cache_dir=str(cache_dir), per_host_interval=0, **kwargs))
+
+def test_fetches_metadata_once(stub, tmp_path):
+    url = f"http://127.0.0.1:{stub.server_port}/page"
+    results = fetch([url], tmp_path, allow_hosts={"127.0.0.1"})
+    assert results[url]["title"] == "Dune"
+    assert results[url]["creator"] == "Frank Herbert"
+
+    # Served from the on-disk cache the second time
+    fetch([url], tmp_path, allow_hosts={"127.0.0.1"})
+    assert stub.hits == ["/page"]
+
+    items = [{"item_id": 1, "title": "", "creator": None, "link": url},
+             {"item_id": 2, "title": "Mine", "creator": "Me", "link": url}]
+    assert build_updates(items, results) == {1: {"title": "Dune", "creator": "Frank Herbert"}}
+
+def test_refuses_loopback(stub, tmp_path):
+    url = f"http://127.0.0.1:{stub.server_port}/page"
+    results = fetch([url], tmp_path)
+    assert results[url]["error"] == "blocked address 127.0.0.1"
+    assert stub.hits == []
+
+def test_checks_every_redirect_hop(stub, tmp_path):
+    url = f"http://127.0.0.1:{stub.server_port}/hop"
+    results = fetch([url], tmp_path, allow_hosts={"127.0.0.1"})
+    assert results[url]["error"].startswith("blocked address")
+    assert stub.hits == ["/hop"]
+
+@pytest.mark.parametrize("url", ["http://169.254.169.254/latest/meta-data/", "http://10.0.0.1/",
+                                 "http://[::1]/", "file:///etc/passwd"])
+def test_rejects_non_public_targets(url):
+    assert asyncio.run(check_url(url)) is not None